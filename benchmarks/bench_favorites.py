@@ -0,0 +1,253 @@
+#
+# Benchmarks for the hot paths of the favorites plugin.
+#
+# This loads favorites/__init__.py with the stand-ins for fman in
+# benchmarks/fakes and a temporary home directory, fills it with
+# synthetic favorites, pairs and shorteners, and reports the p50
+# and p99 latency and the peak memory of each hot path:
+#
+#     python benchmarks/bench_favorites.py --sizes 10,1000,100000
+#
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+REPODIR = os.path.dirname(BENCHDIR)
+
+WORDS = ["alpha", "beta", "gamma", "delta", "projects", "src", "docs", "build",
+         "client", "server", "notes", "photos", "music", "archive", "work", "home"]
+
+#
+# Function:    loadPlugin
+#
+# Description: This function points HOME at a new temporary
+#              directory and imports the plugin with the fake
+#              fman modules in front of the path. The background
+#              watcher is stopped so it doesn't run during the
+#              timings.
+#
+
+
+def loadPlugin():
+    home = tempfile.mkdtemp(prefix="favorites-bench-")
+    os.environ["HOME"] = home
+    sys.path[0:0] = [os.path.join(BENCHDIR, "fakes"), REPODIR]
+    import fman
+    import favorites
+    favorites.WATCHER.stop()
+    return home, fman, favorites
+
+#
+# Function:    FakeWindow and FakePane
+#
+# Description: These classes stand in for fman's window and
+#              panes. Changing the path of a pane calls the
+#              plugin's listener like fman does.
+#
+
+
+class FakeWindow:
+
+    def __init__(self):
+        self.panes = []
+
+    def get_panes(self):
+        return self.panes
+
+
+class FakePane:
+
+    def __init__(self, window, path, plugin):
+        self.window = window
+        self.path = path
+        self.plugin = plugin
+        window.panes.append(self)
+
+    def get_path(self):
+        return "file://" + self.path
+
+    def set_path(self, url, callback=None):
+        if url.startswith("file://"):
+            url = url[len("file://"):]
+        self.path = url
+        self.plugin.PopdirectoryListener(self).on_path_changed()
+        if callback is not None:
+            callback()
+
+    def get_selected_files(self):
+        return []
+
+    def place_cursor_at(self, url):
+        pass
+
+#
+# Function:    makeFiles
+#
+# Description: This function writes the synthetic favorites,
+#              pairs and shortener files for count favorites.
+#
+
+
+def makeFiles(home, count, plugin):
+    rng = random.Random(count)
+    shorteners = []
+    for index in range(max(1, count // 100)):
+        shorteners.append(("s%d" % index, os.path.join(home, "roots", "root%d" % index)))
+    favorites = []
+    for index in range(count):
+        shortName, shortPath = rng.choice(shorteners)
+        parts = [rng.choice(WORDS) for depth in range(rng.randint(1, 4))]
+        favorites.append(("%s-%s-%d" % (rng.choice(WORDS), rng.choice(WORDS), index),
+                          "{{" + shortName + "}}/" + "/".join(parts)))
+    pairs = []
+    for index in range(max(1, count // 10)):
+        pairs.append(("pair-%s-%d" % (rng.choice(WORDS), index),
+                      rng.choice(favorites)[1], rng.choice(favorites)[1]))
+    for fileName, entries in ((plugin.SHORTENERLIST, shorteners),
+                              (plugin.FAVORITELIST, favorites),
+                              (plugin.FAVORITEPAIRS, pairs)):
+        with open(fileName, "w") as f:
+            for entry in entries:
+                f.write("|".join(entry) + "\n")
+    for store in (plugin.SHORTENERS, plugin.FAVORITES, plugin.PAIRS):
+        store.invalidate()
+    plugin.MATCHERS.clear()
+    return shorteners, favorites, pairs
+
+#
+# Function:    measure
+#
+# Description: This function calls run(index) repeat times and
+#              gives the latencies in milliseconds and the peak
+#              memory allocated while doing it.
+#
+
+
+def measure(run, repeat):
+    samples = []
+    tracemalloc.start()
+    for index in range(repeat):
+        start = time.perf_counter()
+        run(index)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return samples, peak
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(size, name, samples, peak):
+    print("%8d  %-34s %6d  %10.3f  %10.3f  %10.1f" % (
+        size, name, len(samples), percentile(samples, 0.5),
+        percentile(samples, 0.99), peak / 1024.0))
+
+#
+# Function:    benchmarkSize
+#
+# Description: This function runs every benchmark for one size of
+#              the favorites list.
+#
+
+
+def benchmarkSize(home, fman, plugin, size, repeat):
+    shorteners, favorites, pairs = makeFiles(home, size, plugin)
+    window = FakeWindow()
+    left = FakePane(window, home, plugin)
+    right = FakePane(window, home, plugin)
+    rng = random.Random(size)
+
+    #
+    # Typing a query one key at a time, as the quicksearch
+    # calls the generators.
+    #
+    queries = []
+    for index in range(repeat):
+        word = rng.choice(WORDS)
+        queries.extend(word[0:length] for length in range(len(word) + 1))
+    goTo = plugin.GoToFavorite(left)
+    samples, peak = measure(lambda index: list(goTo._suggest_directory(queries[index])),
+                            len(queries))
+    report(size, "GoToFavorite keystroke", samples, peak)
+
+    goToPair = plugin.GoToFavoritePair(left)
+    samples, peak = measure(lambda index: list(goToPair._suggest_directory(queries[index])),
+                            len(queries))
+    report(size, "GoToFavoritePair keystroke", samples, peak)
+
+    remove = plugin.RemoveFavoriteDirectory(left)
+    samples, peak = measure(lambda index: list(remove._suggest_favorite(queries[index])),
+                            len(queries))
+    report(size, "RemoveFavoriteDirectory keystroke", samples, peak)
+
+    #
+    # Shortening and expanding paths.
+    #
+    paths = [plugin.expandDirPath(rng.choice(favorites)[1]) for index in range(repeat)]
+    samples, peak = measure(lambda index: plugin.shortenDirPath(paths[index]), repeat)
+    report(size, "shortenDirPath", samples, peak)
+
+    shortened = [rng.choice(favorites)[1] for index in range(repeat)]
+    samples, peak = measure(lambda index: plugin.expandDirPath(shortened[index]), repeat)
+    report(size, "expandDirPath", samples, peak)
+
+    #
+    # Adding and removing favorites. The new favorites go to
+    # directories that aren't favorites yet, so no alert asks
+    # whether to add a directory again.
+    #
+    def addFavorite(index):
+        left.path = os.path.join(paths[index], "bench-%d" % index)
+        fman.PROMPTANSWERS.append("bench-%d" % index)
+        plugin.SetFavoriteDirectory(left)()
+
+    samples, peak = measure(addFavorite, repeat)
+    report(size, "SetFavoriteDirectory", samples, peak)
+
+    def removeFavorite(index):
+        fman.QUICKSEARCHANSWERS.append(("", "bench-%d" % index))
+        plugin.RemoveFavoriteDirectory(left)()
+
+    samples, peak = measure(removeFavorite, repeat)
+    report(size, "RemoveFavoriteDirectory", samples, peak)
+
+    #
+    # The listener that runs on every directory change. The
+    # status bar lookup waits for the watcher's first pass, so
+    # that pass is done here before the timing starts.
+    #
+    plugin.WATCHER.scan()
+    listener = plugin.PopdirectoryListener(right)
+
+    def changePath(index):
+        right.path = paths[index]
+        listener.on_path_changed()
+
+    samples, peak = measure(changePath, repeat)
+    report(size, "on_path_changed", samples, peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the favorites plugin.")
+    parser.add_argument("--sizes", default="10,1000,10000,100000",
+                        help="comma separated numbers of favorites")
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="number of samples for each benchmark")
+    args = parser.parse_args()
+    home, fman, plugin = loadPlugin()
+    print("%8s  %-34s %6s  %10s  %10s  %10s" % (
+        "size", "benchmark", "runs", "p50 ms", "p99 ms", "peak KiB"))
+    for size in [int(size) for size in args.sizes.split(",")]:
+        benchmarkSize(home, fman, plugin, size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
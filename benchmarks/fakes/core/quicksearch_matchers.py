@@ -0,0 +1,17 @@
+#
+# Stand-in for fman's core.quicksearch_matchers. contains_chars
+# gives the positions of the characters of chars found in order
+# in text, or None when they aren't all there.
+#
+
+
+def contains_chars(text, chars):
+    indices = []
+    start = 0
+    for char in chars:
+        start = text.find(char, start)
+        if start < 0:
+            return None
+        indices.append(start)
+        start += 1
+    return indices
@@ -0,0 +1,80 @@
+#
+# This is a stand-in for the parts of fman's API that the
+# favorites plugin uses, so the plugin can be loaded and timed
+# outside of fman. The dialogs don't show anything. Their answers
+# are taken from the lists below, which the benchmarks fill in.
+#
+OK = 1
+YES = 2
+NO = 4
+CANCEL = 8
+
+PROMPTANSWERS = []
+QUICKSEARCHANSWERS = []
+ALERTANSWERS = []
+SETTINGS = {}
+
+
+class DirectoryPaneCommand:
+
+    def __init__(self, pane=None):
+        self.pane = pane
+
+    def get_chosen_files(self):
+        return []
+
+
+class DirectoryPaneListener:
+
+    def __init__(self, pane=None):
+        self.pane = pane
+
+
+class ApplicationCommand:
+
+    def __init__(self, window=None):
+        self.window = window
+
+
+class QuicksearchItem:
+
+    def __init__(self, value, title=None, highlight=None, hint='', description=''):
+        self.value = value
+        self.title = title
+        self.highlight = highlight
+        self.hint = hint
+        self.description = description
+
+
+def show_alert(text, buttons=OK, default_button=OK):
+    if ALERTANSWERS:
+        return ALERTANSWERS.pop(0)
+    return default_button
+
+
+def show_prompt(text, default='', selection_start=0, selection_end=None):
+    if PROMPTANSWERS:
+        return PROMPTANSWERS.pop(0), True
+    return default, True
+
+
+def show_quicksearch(get_items, get_tab_completion=None):
+    if QUICKSEARCHANSWERS:
+        return QUICKSEARCHANSWERS.pop(0)
+    return None
+
+
+def show_status_message(text, timeout_secs=None):
+    pass
+
+
+def clear_status_message():
+    pass
+
+
+def load_json(name, default=None, save_on_quit=False):
+    return SETTINGS.get(name, default)
+
+
+def save_json(name, value=None):
+    SETTINGS[name] = value
@@ -0,0 +1,14 @@
+#
+# Stand-in for fman.fs that only knows the local file system.
+#
+import os
+
+from fman.url import as_human_readable
+
+
+def is_dir(url):
+    return os.path.isdir(as_human_readable(url))
+
+
+def exists(url):
+    return os.path.exists(as_human_readable(url))
@@ -0,0 +1,22 @@
+#
+# Stand-in for fman.url. Only file:// urls are turned into
+# paths, like fman does for the local file system.
+#
+
+
+def as_url(local_file_path, scheme='file://'):
+    return scheme + local_file_path
+
+
+def as_human_readable(url):
+    scheme, path = splitscheme(url)
+    if scheme == 'file://':
+        return path
+    return url
+
+
+def splitscheme(url):
+    separator = url.find('://')
+    if separator < 0:
+        raise ValueError('Not a valid URL: %r' % url)
+    return url[:separator + 3], url[separator + 3:]
@@ -0,0 +1,87 @@
+#
+# Import time budget for the favorites plugin.
+#
+# This imports the plugin in fresh Python processes, with the
+# stand-ins for fman in benchmarks/fakes and an empty home
+# directory, and checks that loading it stays within a few
+# milliseconds of fman's startup. The modules fman itself has
+# already loaded are imported before the timing starts. The byte
+# code is compiled once beforehand, like fman does after the first
+# start. It also checks that importing the plugin doesn't start any
+# threads or touch the home directory, since all of that is left
+# for the first use of a command:
+#
+#     python benchmarks/import_budget.py --budget 5 --runs 20
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+REPODIR = os.path.dirname(BENCHDIR)
+
+MEASURE = """
+import json, os, sys, threading, time
+sys.path[0:0] = [%r, %r]
+import collections, re, fman, fman.url, fman.fs, core.quicksearch_matchers
+threads = threading.active_count()
+start = time.perf_counter()
+import favorites
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000.0,
+                  "threads": threading.active_count() - threads,
+                  "files": os.listdir(os.environ["HOME"])}))
+""" % (os.path.join(BENCHDIR, "fakes"), REPODIR)
+
+#
+# Function:    importOnce
+#
+# Description: This function imports the plugin in a new process
+#              and gives what it measured.
+#
+
+
+def importOnce(cacheDir):
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPYCACHEPREFIX"] = cacheDir
+    env["HOME"] = tempfile.mkdtemp(prefix="favorites-import-")
+    output = subprocess.check_output([sys.executable, "-c", MEASURE], env=env)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the favorites plugin.")
+    parser.add_argument("--budget", type=float, default=5.0,
+                        help="milliseconds the median import may take")
+    parser.add_argument("--runs", type=int, default=20, help="number of imports to time")
+    args = parser.parse_args()
+
+    cacheDir = tempfile.mkdtemp(prefix="favorites-pycache-")
+    importOnce(cacheDir)
+    results = [importOnce(cacheDir) for run in range(args.runs)]
+    times = sorted(result["ms"] for result in results)
+    median = times[len(times) // 2]
+    print("import favorites: median %.2f ms, max %.2f ms over %d runs (budget %.2f ms)" % (
+        median, times[-1], len(times), args.budget))
+
+    failures = []
+    if median > args.budget:
+        failures.append("the median import time is over the budget")
+    if any(result["threads"] for result in results):
+        failures.append("importing started a thread")
+    if any(result["files"] for result in results):
+        failures.append("importing created files in the home directory: %s" %
+                        ", ".join(sorted(set(name for result in results for name in result["files"]))))
+    for failure in failures:
+        print("FAILED: " + failure)
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
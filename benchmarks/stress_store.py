@@ -0,0 +1,123 @@
+#
+# Stress test for sharing a favorites file between processes.
+#
+# This starts many writer processes on one favorites file, the way
+# several fman windows and the Alfred workflow share
+# ~/.favoritedirs. Each writer adds its own favorites and removes
+# some of them again, with a small compaction threshold so the file
+# is also rewritten often. At the end every favorite that was added
+# and not removed has to be in the file, none that were removed,
+# and every line has to be whole:
+#
+#     python benchmarks/stress_store.py --writers 16 --entries 200
+#
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+REPODIR = os.path.dirname(BENCHDIR)
+
+#
+# Function:    loadPlugin
+#
+# Description: This function imports the plugin with the fake
+#              fman modules and the given home directory, and
+#              stops its background watcher.
+#
+
+
+def loadPlugin(home):
+    os.environ["HOME"] = home
+    sys.path[0:0] = [os.path.join(BENCHDIR, "fakes"), REPODIR]
+    import favorites
+    favorites.WATCHER.stop()
+    return favorites
+
+#
+# Function:    writer
+#
+# Description: This function is one writer process. It opens its
+#              own store on the shared file, adds count favorites
+#              and removes every removeEvery'th one it added.
+#
+
+
+def writer(home, number, count, removeEvery, compactThreshold):
+    plugin = loadPlugin(home)
+    plugin.COMPACTTHRESHOLD = compactThreshold
+    store = plugin.FavoritesStore(plugin.FAVORITELIST, 2)
+    for index in range(count):
+        store.append(("w%d-%d" % (number, index), "/stress/w%d/%d" % (number, index)))
+        if removeEvery and index % removeEvery == removeEvery - 1:
+            store.remove("w%d-%d" % (number, index - 1))
+
+
+def expectedEntries(writers, count, removeEvery):
+    entries = {}
+    for number in range(writers):
+        for index in range(count):
+            entries["w%d-%d" % (number, index)] = "/stress/w%d/%d" % (number, index)
+            if removeEvery and index % removeEvery == removeEvery - 1:
+                del entries["w%d-%d" % (number, index - 1)]
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress a favorites file with many writers.")
+    parser.add_argument("--writers", type=int, default=16, help="number of writer processes")
+    parser.add_argument("--entries", type=int, default=200, help="favorites added by each writer")
+    parser.add_argument("--remove-every", type=int, default=2,
+                        help="remove the previous favorite after every this many")
+    parser.add_argument("--compact-threshold", type=int, default=1,
+                        help="dead lines before the file is compacted")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="favorites-stress-")
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    processes = [context.Process(target=writer,
+                                 args=(home, number, args.entries, args.remove_every,
+                                       args.compact_threshold))
+                 for number in range(args.writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    plugin = loadPlugin(home)
+    failures = []
+    if any(process.exitcode != 0 for process in processes):
+        failures.append("a writer process failed")
+    with open(plugin.FAVORITELIST, "r") as f:
+        for lineNumber, line in enumerate(f, 1):
+            if not line.endswith("\n") or ('|' not in line and not line.startswith(plugin.TOMBSTONE)):
+                failures.append("line %d is corrupted: %r" % (lineNumber, line))
+    found = dict(plugin.FavoritesStore(plugin.FAVORITELIST, 2).entries())
+    expected = expectedEntries(args.writers, args.entries, args.remove_every)
+    lost = sorted(set(expected) - set(found))
+    extra = sorted(set(found) - set(expected))
+    wrong = sorted(name for name in set(expected) & set(found) if expected[name] != found[name])
+    if lost:
+        failures.append("%d favorites were lost, like %s" % (len(lost), lost[0]))
+    if extra:
+        failures.append("%d removed favorites came back, like %s" % (len(extra), extra[0]))
+    if wrong:
+        failures.append("%d favorites have the wrong path, like %s" % (len(wrong), wrong[0]))
+
+    print("%d writers, %d operations in %.2f s, %d favorites" % (
+        args.writers, args.writers * (args.entries + args.entries // max(1, args.remove_every)),
+        elapsed, len(found)))
+    for failure in failures:
+        print("FAILED: " + failure)
+    if not failures:
+        print("OK: no lost or corrupted favorites")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
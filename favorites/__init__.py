@@ -2,11 +2,23 @@
 # Load the libraries that are used in these commands.
 #
 from core.quicksearch_matchers import contains_chars
-from fman import DirectoryPaneCommand, show_prompt, show_alert, show_quicksearch, QuicksearchItem, show_status_message, clear_status_message, DirectoryPaneListener
+from fman import DirectoryPaneCommand, show_prompt, show_alert, show_quicksearch, QuicksearchItem, show_status_message, clear_status_message, DirectoryPaneListener, load_json, YES, NO
+import atexit
+import bisect
+import collections
+import heapq
+import json
 import os
 import re
+import stat
+import threading
+import time
 from fman.url import as_human_readable, as_url, splitscheme
 from fman.fs import is_dir
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 #
 # I'm using two globals because it is faster for checking
@@ -18,13 +30,1274 @@ HOMEDIR = os.path.expanduser("~")
 FAVORITELIST = HOMEDIR + "/.favoritedirs"
 SHORTENERLIST = HOMEDIR + "/.shortenerdirs"
 FAVORITEPAIRS = HOMEDIR + "/.favoritepairs" 
+FRECENCYLIST = HOMEDIR + "/.favoritefrecency"
+HISTORYLIST = HOMEDIR + "/.favoritehistory"
+VISITLOG = HOMEDIR + "/.favoritevisits"
+HOTDIRLIST = HOMEDIR + "/.favoritehotdirs"
+WORKSPACELIST = HOMEDIR + "/.favoriteworkspaces"
+FINDINDEXDIR = HOMEDIR + "/.favoritefindindex"
+FAVORITESDATABASE = HOMEDIR + "/.favorites.sqlite"
 
 #
-# The next global variable is for storing short term memory
-# of directory locations. These will be quickly jumped to
-# with hotkeys. I doubt I'll ever need more than four.
+# The plugin's settings are kept in fman's settings directory.
+# "storage" selects the backend for favorites and pairs: "text"
+# (the default) keeps the files above, "sqlite" uses the indexed
+# FAVORITESDATABASE file.
 #
-HOTLIST = ["~", "~", "~", "~"]
+SETTINGSFILE = "Favorites Settings.json"
+
+
+def getSetting(name, default=None):
+    settings = load_json(SETTINGSFILE, default={})
+    return settings.get(name, default)
+
+#
+# Function:    PerformanceStats
+#
+# Description: This class collects timings and counters from the
+#              hot paths of the plugin. Timings go into a ring of
+#              the last PERFSAMPLES samples, so recording one is
+#              just a deque append. Counters named "<name> hit"
+#              and "<name> miss" are shown as cache hit rates.
+#              Calls too frequent for the ring, like expanding one
+#              path, are tallied instead: only their count and
+#              total time are kept.
+#
+
+
+PERFSAMPLES = 5000
+
+
+class PerformanceStats:
+
+    def __init__(self, size):
+        self.samples = collections.deque(maxlen=size)
+        self.counters = collections.Counter()
+        self.totals = collections.defaultdict(lambda: [0, 0.0])
+
+    def record(self, name, seconds):
+        self.samples.append((name, seconds))
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def tally(self, name, seconds):
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += seconds
+
+    def timer(self, name):
+        return PerformanceTimer(self, name)
+
+    def summary(self):
+        timings = {}
+        for name, seconds in list(self.samples):
+            timings.setdefault(name, []).append(seconds * 1000.0)
+        result = {}
+        for name, values in timings.items():
+            values.sort()
+            result[name] = {
+                "count": len(values),
+                "p50": values[len(values) // 2],
+                "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+                "total": sum(values)
+            }
+        return result
+
+    def hitRates(self):
+        counters = dict(self.counters)
+        rates = {}
+        for name, hits in counters.items():
+            if name.endswith(" hit"):
+                cache = name[0:-len(" hit")]
+                misses = counters.get(cache + " miss", 0)
+                rates[cache] = (hits, hits + misses)
+        for name, misses in counters.items():
+            if name.endswith(" miss"):
+                cache = name[0:-len(" miss")]
+                rates.setdefault(cache, (0, misses))
+        return rates
+
+    def report(self):
+        lines = ["Timings in ms (count, p50, p99):"]
+        for name, timing in sorted(self.summary().items()):
+            lines.append("%s: %d, %.2f, %.2f" % (name, timing["count"], timing["p50"], timing["p99"]))
+        lines.append("")
+        lines.append("Totals in ms (count, total, mean):")
+        for name, (count, seconds) in sorted(self.totals.items()):
+            lines.append("%s: %d, %.2f, %.4f" % (name, count, seconds * 1000.0,
+                                                 seconds * 1000.0 / max(1, count)))
+        lines.append("")
+        lines.append("Cache hit rates:")
+        for name, (hits, total) in sorted(self.hitRates().items()):
+            lines.append("%s: %d of %d (%d%%)" % (name, hits, total, 100 * hits // max(1, total)))
+        return "\n".join(lines)
+
+    def dump(self, fileName):
+        state = {
+            "timings": self.summary(),
+            "counters": dict(self.counters),
+            "totals": dict((name, {"count": count, "total": seconds * 1000.0})
+                           for name, (count, seconds) in self.totals.items()),
+            "samples": [[name, seconds * 1000.0] for name, seconds in list(self.samples)]
+        }
+        with open(fileName, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+
+
+class PerformanceTimer:
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stats.record(self.name, time.perf_counter() - self.start)
+
+
+STATS = PerformanceStats(PERFSAMPLES)
+
+#
+# Function:    atomicWriteLines
+#
+# Description: This function replaces the contents of a file
+#              without ever leaving it empty or half written. The
+#              lines go to a temporary file in the same directory
+#              that is synced to disk and then renamed over the
+#              original. Symbolic links (like the Dropbox links
+#              from the README) are followed so that the link
+#              itself is kept, and the temporary file gets the
+#              permissions of the original.
+#
+
+
+def atomicWriteLines(fileName, lines):
+    import tempfile
+    fileName = os.path.realpath(fileName)
+    fd, tempName = tempfile.mkstemp(prefix=os.path.basename(fileName) + ".",
+                                    dir=os.path.dirname(fileName))
+    try:
+        try:
+            os.chmod(tempName, stat.S_IMODE(os.stat(fileName).st_mode))
+        except FileNotFoundError:
+            pass
+        with os.fdopen(fd, "w") as f:
+            for line in lines:
+                f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempName, fileName)
+    except BaseException:
+        try:
+            os.remove(tempName)
+        except OSError:
+            pass
+        raise
+
+#
+# Function:    FileLock
+#
+# Description: This class is the lock that fman windows and other
+#              programs (like the Alfred workflow) use to share a
+#              favorites file. It is an advisory fcntl lock on a
+#              separate lock file next to it, since the favorites
+#              file itself is replaced by compactions. Readers
+#              hold it shared and writers hold it exclusive. It
+#              also holds a thread lock, so threads of the same
+#              process take turns first.
+#
+#              The lock file holds a counter that every writer
+#              increases while it holds the lock. Checking whether
+#              a cached copy is fresh is then a read of a few
+#              bytes, which also catches changes that leave the
+#              modification time and size of the file the same.
+#              Without fcntl (on Windows) only the thread lock is
+#              used and the counter is always 0.
+#
+
+
+COUNTERWIDTH = 20
+
+
+class FileLock:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._fd is None and fcntl is not None:
+            try:
+                self._fd = os.open(self.fileName, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                pass
+        return self._fd
+
+    def shared(self):
+        return FileLockHolder(self, False)
+
+    def exclusive(self):
+        return FileLockHolder(self, True)
+
+    def acquire(self, exclusive):
+        self._lock.acquire()
+        fd = self._open()
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def counter(self):
+        fd = self._open()
+        if fd is None:
+            return 0
+        try:
+            return int(os.pread(fd, COUNTERWIDTH, 0) or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self):
+        fd = self._open()
+        if fd is not None:
+            os.pwrite(fd, b"%*d" % (COUNTERWIDTH, self.counter() + 1), 0)
+
+
+class FileLockHolder:
+
+    def __init__(self, lock, exclusive):
+        self.lock = lock
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        self.lock.acquire(self.exclusive)
+        return self.lock
+
+    def __exit__(self, excType, excValue, traceback):
+        self.lock.release()
+        return False
+
+#
+# Function:    FavoritesStore
+#
+# Description: This class keeps the parsed contents of one of
+#              the favorites files in memory. Every line is
+#              split into a tuple of fields once. The file is
+#              only read again when its stat information
+#              (modification time, size or inode) changes, so
+#              the quicksearch doesn't re-read the file on
+#              every keystroke.
+#
+#              All changes to the files go through this class.
+#              Adding an entry appends one line. An entry with
+#              the same name earlier in the file is replaced by
+#              the later one. Removing an entry appends a
+#              tombstone line (TOMBSTONE followed by the name,
+#              without a "|" so older readers skip it). Once
+#              there are more dead lines than COMPACTTHRESHOLD,
+#              the file is compacted with an atomic rewrite. The
+#              threshold is kept small since other readers of the
+#              file (like the Alfred workflow) still show the
+#              removed and replaced lines.
+#
+#              Entries have fieldCount fields. A variable store
+#              keeps all the fields of a line instead, with at
+#              least fieldCount of them.
+#
+#              The file is read while holding its FileLock shared,
+#              and each change is made while holding it exclusive,
+#              after reading any change made by another process,
+#              so no update is lost. The counter of the lock is
+#              part of the stat information that is compared.
+#
+#              The parsed file is kept as an immutable snapshot
+#              that is swapped in as a whole. When the store is
+#              watched by the FavoritesWatcher thread, readers
+#              take the current snapshot without checking the
+#              file at all.
+#
+
+
+TOMBSTONE = "-"
+COMPACTTHRESHOLD = 8
+
+StoreSnapshot = collections.namedtuple("StoreSnapshot", "entries index signature")
+
+
+class FavoritesStore:
+
+    def __init__(self, fileName, fieldCount, variable=False):
+        self.fileName = fileName
+        self.fieldCount = fieldCount
+        self.variable = variable
+        self.version = 0
+        self.watched = False
+        self._snapshot = StoreSnapshot((), {}, None)
+        self._loaded = False
+        self._deadLines = 0
+        self._needsNewline = False
+        self._lock = FileLock(fileName + ".lock")
+
+    def _statSignature(self):
+        try:
+            st = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (self._lock.counter(), st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _parse(self, lines):
+        entries = {}
+        lineCount = 0
+        lastLine = "\n"
+        for line in lines:
+            lastLine = line
+            if '|' in line:
+                fields = line.strip().split('|')
+                if len(fields) >= self.fieldCount:
+                    if self.variable:
+                        entry = tuple(fields)
+                    else:
+                        entry = tuple(fields[0:self.fieldCount])
+                    entries.pop(entry[0], None)
+                    entries[entry[0]] = entry
+                    lineCount += 1
+            elif line.startswith(TOMBSTONE):
+                entries.pop(line[len(TOMBSTONE):].strip(), None)
+                lineCount += 1
+        self._deadLines = lineCount - len(entries)
+        self._needsNewline = not lastLine.endswith("\n")
+        return list(entries.values())
+
+    def _setEntries(self, entries, signature):
+        index = {}
+        for entry in entries:
+            index[entry[0]] = entry
+        self._snapshot = StoreSnapshot(tuple(entries), index, signature)
+        self._loaded = True
+        self.version += 1
+
+    def _refresh(self):
+        signature = self._statSignature()
+        if not self._loaded or signature != self._snapshot.signature:
+            STATS.count("store miss")
+            entries = []
+            self._deadLines = 0
+            self._needsNewline = False
+            if signature is not None:
+                with STATS.timer("read " + os.path.basename(self.fileName)):
+                    with open(self.fileName, "r") as f:
+                        lines = f.readlines()
+                with STATS.timer("parse " + os.path.basename(self.fileName)):
+                    entries = self._parse(lines)
+            self._setEntries(entries, signature)
+        else:
+            STATS.count("store hit")
+
+    def refresh(self):
+        with self._lock.shared():
+            self._refresh()
+
+    def snapshot(self):
+        if not (self.watched and self._loaded):
+            WATCHER.ensureRunning()
+            self.refresh()
+        return self._snapshot
+
+    def entries(self):
+        return self.snapshot().entries
+
+    def lookup(self, name):
+        return self.snapshot().index.get(name)
+
+    def invalidate(self):
+        with self._lock.shared():
+            self._loaded = False
+
+    def _appendLine(self, line):
+        with open(self.fileName, "a") as f:
+            if self._needsNewline:
+                f.write("\n")
+            f.write(line + "\n")
+        self._needsNewline = False
+        self._lock.bump()
+
+    def _rewrite(self, entries):
+        atomicWriteLines(self.fileName, ("|".join(entry) for entry in entries))
+        self._lock.bump()
+        self._deadLines = 0
+        self._needsNewline = False
+        self._setEntries(entries, self._statSignature())
+
+    def _compactIfNeeded(self):
+        if self._deadLines > COMPACTTHRESHOLD:
+            self._rewrite(self._snapshot.entries)
+
+    def append(self, entry):
+        entry = tuple(entry)
+        with self._lock.exclusive():
+            self._refresh()
+            self._appendLine("|".join(entry))
+            entries = self._snapshot.entries
+            if entry[0] in self._snapshot.index:
+                entries = tuple(oldEntry for oldEntry in entries
+                                if oldEntry[0] != entry[0])
+                self._deadLines += 1
+            self._setEntries(entries + (entry,), self._statSignature())
+            self._compactIfNeeded()
+
+    def remove(self, name):
+        with self._lock.exclusive():
+            self._refresh()
+            if name not in self._snapshot.index:
+                return False
+            self._appendLine(TOMBSTONE + name)
+            self._deadLines += 2
+            self._setEntries([entry for entry in self._snapshot.entries if entry[0] != name],
+                             self._statSignature())
+            self._compactIfNeeded()
+            return True
+
+    def extend(self, entries):
+        #
+        # This adds many entries with a single write to the end
+        # of the file.
+        #
+        entries = [tuple(entry) for entry in entries]
+        if not entries:
+            return
+        with self._lock.exclusive():
+            self._refresh()
+            self._appendLine("\n".join("|".join(entry) for entry in entries))
+            index = dict(self._snapshot.index)
+            for entry in entries:
+                if entry[0] in index:
+                    self._deadLines += 1
+                index.pop(entry[0], None)
+                index[entry[0]] = entry
+            self._setEntries(list(index.values()), self._statSignature())
+            self._compactIfNeeded()
+
+    def rewrite(self, entries):
+        with self._lock.exclusive():
+            self._rewrite([tuple(entry) for entry in entries])
+
+    def compact(self):
+        with self._lock.exclusive():
+            self._refresh()
+            self._rewrite(self._snapshot.entries)
+
+    def _rewriteLines(self, lines, rewritePath):
+        for line in lines:
+            line = line.rstrip("\n")
+            if '|' in line:
+                fields = line.split('|')
+                line = "|".join([fields[0]] + [rewritePath(field) for field in fields[1:]])
+            yield line
+
+    def rewritePaths(self, rewritePath):
+        #
+        # This streams the file through rewritePath one line at
+        # a time into a single atomic replace. Tombstones and
+        # other lines are copied as they are.
+        #
+        with self._lock.exclusive():
+            if os.path.isfile(self.fileName):
+                with open(self.fileName, "r") as f:
+                    atomicWriteLines(self.fileName, self._rewriteLines(f, rewritePath))
+                self._lock.bump()
+            self._loaded = False
+            self._refresh()
+
+
+#
+# Function:    openStore
+#
+# Description: This function opens the store for a list of
+#              favorites using the backend from the settings.
+#              The first time the SQLite backend is used, the
+#              entries of the text file are imported into it.
+#              This happens only once, even when all the entries
+#              are removed later.
+#
+
+
+def openStore(fileName, fieldCount, table):
+    if getSetting("storage", "text") != "sqlite":
+        return FavoritesStore(fileName, fieldCount)
+    from .sqlitestore import SqliteFavoritesStore
+    store = SqliteFavoritesStore(FAVORITESDATABASE, table, fieldCount)
+    store.importOnce(FavoritesStore(fileName, fieldCount).entries)
+    return store
+
+
+#
+# Function:    LazyStore
+#
+# Description: This class stands in for a store that is opened
+#              with openStore. The settings are only read, and the
+#              SQLite module only imported, the first time the
+#              store is used, instead of while fman is starting.
+#              After that every attribute is passed on to the
+#              opened store.
+#
+
+
+class LazyStore:
+
+    def __init__(self, fileName, fieldCount, table):
+        self.__dict__["_arguments"] = (fileName, fieldCount, table)
+        self.__dict__["_store"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def store(self):
+        store = self._store
+        if store is None:
+            with self._lock:
+                store = self._store
+                if store is None:
+                    store = openStore(*self._arguments)
+                    self.__dict__["_store"] = store
+        return store
+
+    def __getattr__(self, name):
+        return getattr(self.store(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.store(), name, value)
+
+
+FAVORITES = LazyStore(FAVORITELIST, 2, "favorites")
+SHORTENERS = FavoritesStore(SHORTENERLIST, 2)
+PAIRS = LazyStore(FAVORITEPAIRS, 3, "pairs")
+WORKSPACES = FavoritesStore(WORKSPACELIST, 2, variable=True)
+
+#
+# Function:    FavoritesWatcher
+#
+# Description: This class is a background thread that checks the
+#              favorites, shortener, pair and workspace files every
+#              WATCHINTERVAL seconds. When one of them has changed
+#              (for example by Dropbox or the Alfred workflow), it
+#              is parsed on this thread and the new snapshot is
+#              swapped in. The compiled shortener index and the
+#              reverse path index are rebuilt here as well, so the
+#              quicksearch and the status bar always find them
+#              ready, and the frecency table, navigation history
+#              and hot dirs are loaded here. Once the first pass
+#              over all of that is done, ready is set.
+#
+#              It isn't started while fman starts. The first time
+#              a store is read without it, ensureRunning starts it.
+#              scan does one pass on the calling thread.
+#
+
+
+WATCHINTERVAL = 2
+
+
+class FavoritesWatcher(threading.Thread):
+
+    def __init__(self, stores):
+        threading.Thread.__init__(self, name="FavoritesWatcher")
+        self.daemon = True
+        self.stores = stores
+        self.ready = False
+        self._launched = False
+        self._launchLock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def ensureRunning(self):
+        if self._launched:
+            return
+        with self._launchLock:
+            if not self._launched and not self._stopped.is_set():
+                self._launched = True
+                self.start()
+
+    def scan(self):
+        for store in self.stores:
+            try:
+                store.refresh()
+                store.watched = True
+            except Exception:
+                store.watched = False
+        for task in (getShortenerIndex, PATHINDEX.update, FRECENCY.load, HISTORY.load,
+                     HOTDIRS.load):
+            try:
+                task()
+            except Exception:
+                pass
+        self.ready = True
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.scan()
+            self._stopped.wait(WATCHINTERVAL)
+        for store in self.stores:
+            store.watched = False
+
+    def stop(self):
+        self._stopped.set()
+
+
+WATCHER = FavoritesWatcher([FAVORITES, SHORTENERS, PAIRS, WORKSPACES])
+
+#
+# The quicksearch never shows more than this many items. Huge
+# lists otherwise push thousands of items to the UI on every
+# keystroke.
+#
+MAXSUGGESTIONS = 100
+
+#
+# Function:    FavoritesMatcher
+#
+# Description: This class matches a quicksearch query against
+#              the names of a list of entries. The names are
+#              lowercased once when the matcher is built. When
+#              a query extends the previous query, only the
+#              entries that matched the previous query are
+#              checked again. Matches are ranked by how well
+#              they match: exact, prefix, substring and then
+#              scattered characters.
+#
+#              For long lists a query that can't be narrowed is
+#              first run as one regular expression over all the
+#              lowercased names joined into a single string. Only
+#              the names it finds are ranked, which keeps lists
+#              like the visited directories fast. When the entries
+#              are already in the order of their scores (ordered),
+#              the scan goes through exact, prefix, substring and
+#              scattered matches in turn and stops once it has
+#              found enough for the list. Those candidates aren't
+#              all the matches, so the next query isn't narrowed
+#              from them.
+#
+#              Frecency scores are only worked out for the entries
+#              that are ranked, and only one category of matches
+#              at a time until the list is full. A keysEntry
+#              function gives the frecency keys (the expanded
+#              paths) of an entry. They are found once for each
+#              entry of the snapshot, and a score is kept until a
+#              visit to one of its keys is merged into the
+#              frecency table. Until the table has been loaded
+#              the entries are ranked without scores.
+#
+#              When the matcher is given a stateEntry function,
+#              the results shown are checked with it: favorites
+#              whose directory is missing or slow to reach get a
+#              hint and are moved to the end of the list.
+#              Otherwise a hintEntry function can give the hint.
+#
+
+
+SCANMINIMUM = 2000
+
+
+class FavoritesMatcher:
+
+    def __init__(self, entries, defaults=(), scoreEntry=None, stateEntry=None, keysEntry=None,
+                 ordered=False, hintEntry=None):
+        self.entries = entries
+        self.allEntries = defaults + entries
+        self.names = [entry[0] for entry in self.allEntries]
+        self.lowered = [name.lower() for name in self.names]
+        self.scoreEntry = scoreEntry
+        self.stateEntry = stateEntry
+        self.keysEntry = keysEntry
+        self.ordered = ordered
+        self.hintEntry = hintEntry
+        self._ranking = scoreEntry is not None
+        self._scores = {}
+        self._keyIndexes = {}
+        self._frecencyVersion = None
+        self._shortenerIndex = None
+        self._reference = time.time()
+        self._lastQuery = None
+        self._lastCandidates = None
+        self._lastComplete = False
+        self._blob = None
+        self._starts = None
+
+    def _updateScores(self):
+        if self.keysEntry is None:
+            return
+        self._ranking = FRECENCY.ready
+        if not self._ranking:
+            return
+        index = getShortenerIndex()
+        version, changed = FRECENCY.changes(self._frecencyVersion)
+        if changed is None or index is not self._shortenerIndex:
+            self._scores = {}
+            self._keyIndexes = {}
+            self._shortenerIndex = index
+        else:
+            for key in changed:
+                for entryIndex in self._keyIndexes.pop(key, ()):
+                    self._scores.pop(entryIndex, None)
+        self._frecencyVersion = version
+
+    def _score(self, index):
+        if not self._ranking:
+            return 0
+        score = self._scores.get(index)
+        if score is None:
+            entry = self.allEntries[index]
+            if self.keysEntry is not None:
+                keys = self.keysEntry(entry, self._shortenerIndex)
+                for key in keys:
+                    self._keyIndexes.setdefault(key, set()).add(index)
+                score = -FRECENCY.scoreKeys(keys, self._reference)
+            else:
+                score = -self.scoreEntry(entry)
+            self._scores[index] = score
+        return score
+
+    def _candidates(self, query, limit):
+        if self._lastQuery is not None and self._lastComplete and query.startswith(self._lastQuery):
+            STATS.count("narrowing hit")
+            return self._lastCandidates, True
+        STATS.count("narrowing miss")
+        if len(self.names) < SCANMINIMUM:
+            return range(len(self.names)), True
+        return self._scan(query, limit if self.ordered else None)
+
+    def _scan(self, query, limit):
+        if self._blob is None:
+            starts = []
+            position = 1
+            for lowered in self.lowered:
+                starts.append(position)
+                position += len(lowered) + 1
+            self._starts = starts
+            self._blob = "\n" + "\n".join(self.lowered) + "\n"
+        scattered = re.escape(query[0]) + "".join("[^\n" + re.escape(char) + "]*" + re.escape(char)
+                                                  for char in query[1:]) + "[^\n]*"
+        if limit is None:
+            patterns = [scattered]
+        else:
+            literal = re.escape(query)
+            patterns = ["\n" + literal + "(?=\n)", "\n" + literal, literal, scattered]
+        indexes = []
+        found = set()
+        for pattern in patterns:
+            for match in re.finditer(pattern, self._blob):
+                index = bisect.bisect_right(self._starts, match.end() - 1) - 1
+                if index not in found:
+                    found.add(index)
+                    indexes.append(index)
+                    if limit is not None and len(indexes) >= limit:
+                        return indexes, False
+        return indexes, True
+
+    def _rank(self, index, query):
+        lowered = self.lowered[index]
+        position = lowered.find(query)
+        if position >= 0:
+            highlight = list(range(position, position + len(query)))
+            if position == 0:
+                category = 0 if len(lowered) == len(query) else 1
+            else:
+                category = 2
+            return (category, 0, position, len(lowered), index), highlight
+        highlight = contains_chars(lowered, query)
+        if not highlight:
+            return None, None
+        spread = highlight[-1] - highlight[0] - len(highlight) + 1
+        return (3, spread, highlight[0], len(lowered), index), highlight
+
+    def _rankKey(self, match):
+        rank = match[0]
+        return (rank[0], self._score(rank[-1])) + rank[1:]
+
+    def _items(self, results):
+        if self.stateEntry is None:
+            for index, highlight in results:
+                hint = "" if self.hintEntry is None else self.hintEntry(self.allEntries[index])
+                yield QuicksearchItem(self.names[index], highlight=highlight, hint=hint)
+            return
+        states = [self.stateEntry(self.allEntries[index]) for index, highlight in results]
+        order = sorted(range(len(results)), key=lambda position: TARGETORDER[states[position]])
+        for position in order:
+            index, highlight = results[position]
+            yield QuicksearchItem(self.names[index], highlight=highlight,
+                                  hint=TARGETHINTS[states[position]])
+
+    def suggest(self, query, limit=MAXSUGGESTIONS):
+        with STATS.timer("suggest"):
+            self._updateScores()
+            return list(self._items([(rank[-1], highlight) for rank, highlight in
+                                     self._matches(query.lower(), limit)]))
+
+    def ranked(self, query, limit=MAXSUGGESTIONS):
+        #
+        # This gives (key, name, highlight) for the best matches,
+        # where sorting by key gives the order of suggest. It is
+        # for merging the matches of more than one matcher.
+        #
+        with STATS.timer("suggest"):
+            self._updateScores()
+            return [(self._rankKey(match), self.names[match[0][-1]], match[1])
+                    for match in self._matches(query.lower(), limit)]
+
+    def _matches(self, query, limit):
+        if not query:
+            self._lastQuery = None
+            self._lastCandidates = None
+            indexes = range(len(self.names))
+            if self._ranking and not self.ordered:
+                indexes = heapq.nsmallest(limit, indexes, key=lambda index: (self._score(index), index))
+            return [((0, index), None) for index in indexes[0:limit]]
+        categories = {}
+        candidates = []
+        indexes, complete = self._candidates(query, limit)
+        for index in indexes:
+            rank, highlight = self._rank(index, query)
+            if rank is not None:
+                candidates.append(index)
+                categories.setdefault(rank[0], []).append((rank, highlight))
+        self._lastQuery = query
+        self._lastCandidates = candidates
+        self._lastComplete = complete
+        results = []
+        for category in sorted(categories):
+            results.extend(heapq.nsmallest(limit - len(results), categories[category],
+                                           key=self._rankKey))
+            if len(results) >= limit:
+                break
+        return results
+
+
+MATCHERS = {}
+
+#
+# Function:    suggestEntries
+#
+# Description: This function gives the quicksearch items for a
+#              list of entries. The matcher for the list is kept
+#              until the entries change so that the lowercased
+#              names, the frecency keys and scores, and the
+#              previous query's matches are reused from one
+#              keystroke to the next. getMatcher gives the kept
+#              matcher itself.
+#
+
+
+def suggestEntries(key, entries, query, defaults=(), scoreEntry=None, stateEntry=None,
+                   keysEntry=None, ordered=False, hintEntry=None):
+    return getMatcher(key, entries, defaults, scoreEntry, stateEntry, keysEntry, ordered,
+                      hintEntry).suggest(query)
+
+
+def getMatcher(key, entries, defaults=(), scoreEntry=None, stateEntry=None, keysEntry=None,
+               ordered=False, hintEntry=None):
+    matcher = MATCHERS.get(key)
+    if matcher is None or matcher.entries is not entries:
+        STATS.count("matcher miss")
+        with STATS.timer("build matcher"):
+            matcher = FavoritesMatcher(entries, defaults, scoreEntry, stateEntry, keysEntry,
+                                       ordered, hintEntry)
+        MATCHERS[key] = matcher
+    else:
+        STATS.count("matcher hit")
+    return matcher
+
+#
+# Function:    TargetValidator
+#
+# Description: This class checks whether the directories of
+#              favorites still exist. The checks are queued and
+#              each runs on its own thread, with at most
+#              VALIDATIONWORKERS of them running at once, and the
+#              results are kept for VALIDATIONTTL seconds. Asking
+#              for the state of a directory never waits: it gives
+#              the cached result, or queues a check and gives
+#              TARGETUNKNOWN.
+#
+#              A check that has been running for longer than
+#              VALIDATIONTIMEOUT seconds is reported as TARGETSLOW
+#              until it finishes. It no longer counts against the
+#              workers, so a hung network mount doesn't hold up
+#              the other checks. No more than VALIDATIONTHREADS
+#              checks run in all.
+#
+
+
+TARGETALIVE = "alive"
+TARGETUNKNOWN = "unknown"
+TARGETSLOW = "slow"
+TARGETDEAD = "dead"
+TARGETORDER = {TARGETALIVE: 0, TARGETUNKNOWN: 0, TARGETSLOW: 1, TARGETDEAD: 2}
+TARGETHINTS = {TARGETALIVE: "", TARGETUNKNOWN: "", TARGETSLOW: "slow", TARGETDEAD: "missing"}
+VALIDATIONTTL = 60
+VALIDATIONTIMEOUT = 2
+VALIDATIONWORKERS = 4
+VALIDATIONTHREADS = 16
+
+
+class TargetValidator:
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._results = {}
+        self._pending = {}
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+
+    def _check(self, url):
+        scheme, path = splitscheme(url)
+        if scheme == 'file://':
+            try:
+                return stat.S_ISDIR(os.stat(path).st_mode)
+            except OSError:
+                return False
+        return is_dir(url)
+
+    def _run(self, url):
+        try:
+            with STATS.timer("validate"):
+                alive = self._check(url)
+        except Exception:
+            alive = False
+        with self._lock:
+            self._pending.pop(url, None)
+            self._results[url] = (TARGETALIVE if alive else TARGETDEAD, time.time())
+            self._startChecks(time.time())
+
+    def _startChecks(self, now):
+        #
+        # This starts queued checks while fewer than workers of
+        # the running ones are within their timeout. The time a
+        # check started is only set here, so the time spent in
+        # the queue doesn't make it look slow.
+        #
+        running = [started for started in self._pending.values() if started is not None]
+        active = sum(1 for started in running if now - started <= VALIDATIONTIMEOUT)
+        while self._queue and active < self.workers and len(running) < VALIDATIONTHREADS:
+            url = self._queue.popleft()
+            self._pending[url] = now
+            running.append(now)
+            active += 1
+            thread = threading.Thread(target=self._run, args=(url,), name="FavoritesValidator")
+            thread.daemon = True
+            thread.start()
+
+    def state(self, url):
+        now = time.time()
+        with self._lock:
+            result = self._results.get(url)
+            if result is not None and now - result[1] < VALIDATIONTTL:
+                return result[0]
+            if url not in self._pending:
+                self._pending[url] = None
+                self._queue.append(url)
+            self._startChecks(now)
+            started = self._pending.get(url)
+            if started is not None and now - started > VALIDATIONTIMEOUT:
+                return TARGETSLOW
+            return TARGETUNKNOWN if result is None else result[0]
+
+    def worstState(self, urls):
+        states = [self.state(url) for url in urls]
+        return max(states, key=lambda state: TARGETORDER[state])
+
+
+VALIDATOR = TargetValidator(VALIDATIONWORKERS)
+
+#
+# Function:    DirectoryPrefetcher
+#
+# Description: This class warms the directory listings of the
+#              favorites most likely to be opened next. The top
+#              entries of the quicksearch are listed and stat'ed
+#              on a small pool of worker threads, so the OS has
+#              them cached when set_path asks for them. At most
+#              PREFETCHMAXENTRIES entries are read per directory
+#              and nothing is kept in memory. When the query
+#              changes, work for directories that dropped out of
+#              the top entries is cancelled.
+#
+
+
+PREFETCHCOUNT = 3
+PREFETCHWORKERS = 2
+PREFETCHMAXENTRIES = 2000
+PREFETCHTTL = 30
+
+
+class DirectoryPrefetcher:
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._running = {}
+        self._done = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _warm(self, path, cancelled):
+        count = 0
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if cancelled.is_set() or count >= PREFETCHMAXENTRIES:
+                        break
+                    try:
+                        entry.stat()
+                    except OSError:
+                        pass
+                    count += 1
+        except OSError:
+            pass
+        with self._lock:
+            if self._running.get(path, (None, None))[1] is cancelled:
+                del self._running[path]
+                if not cancelled.is_set():
+                    self._done[path] = time.time()
+
+    def prefetch(self, urls):
+        paths = []
+        for url in urls:
+            scheme, path = splitscheme(url)
+            if scheme == 'file://':
+                paths.append(path)
+        now = time.time()
+        with self._lock:
+            for path, stamp in list(self._done.items()):
+                if now - stamp >= PREFETCHTTL:
+                    del self._done[path]
+            for path in list(self._running):
+                if path not in paths:
+                    future, cancelled = self._running.pop(path)
+                    cancelled.set()
+                    future.cancel()
+            for path in paths:
+                if path in self._running or path in self._done:
+                    continue
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(self.workers)
+                cancelled = threading.Event()
+                self._running[path] = (self._executor.submit(self._warm, path, cancelled), cancelled)
+
+
+PREFETCHER = DirectoryPrefetcher(PREFETCHWORKERS)
+
+#
+# Function:    prefetchFavorites
+#
+# Description: This function hands the urls of the first items
+#              of a quicksearch to the prefetcher, when the
+#              "prefetch" setting is on. Targets known to be
+#              missing or slow are skipped.
+#
+
+
+def prefetchFavorites(items, urlsForName):
+    if not getSetting("prefetch", False):
+        return items
+    urls = []
+    for item in items[0:PREFETCHCOUNT]:
+        for url in urlsForName(item.value):
+            if VALIDATOR.state(url) in (TARGETALIVE, TARGETUNKNOWN):
+                urls.append(url)
+    PREFETCHER.prefetch(urls)
+    return items
+
+#
+# Function:    navigate
+#
+# Description: This function moves a pane to a url and records
+#              how long it took.
+#
+
+
+def navigate(pane, url):
+    with STATS.timer("navigate"):
+        pane.set_path(url)
+
+#
+# Function:    favoriteUrl
+#
+# Description: This function expands the path of a favorite and
+#              gives the url for it.
+#
+
+
+def favoriteUrl(favPath):
+    if '://' in favPath:
+        return expandDirPath(favPath)
+    return as_url(expandDirPath(favPath))
+
+#
+# Function:    frecencyKeys
+#
+# Description: This function gives the frecency keys of a list of
+#              stored paths, expanded with the shortener index.
+#
+
+
+def frecencyKeys(index, paths):
+    return tuple(FRECENCY.key(index.expand(path)) for path in paths)
+
+#
+# Function:    splitPaneState
+#
+# Description: This function splits the field of one pane of a
+#              workspace into the pane's path and the name of the
+#              file under the cursor (or None). The two are
+#              separated by PANESTATESEPARATOR.
+#
+
+
+PANESTATESEPARATOR = "\t"
+
+
+def splitPaneState(field):
+    path, separator, cursor = field.partition(PANESTATESEPARATOR)
+    return path, cursor or None
+
+#
+# Function:    applyWorkspace
+#
+# Description: This function moves the panes of the window to the
+#              pane fields of a workspace (or pair). All the paths
+#              are expanded in one batch with the same shortener
+#              index. Every pane's set_path is then started on its
+#              own thread, so the workspace takes about as long as
+#              its slowest pane instead of the sum of all of them.
+#              Extra fields or panes are left alone.
+#
+
+
+def applyWorkspace(panes, fields):
+    with STATS.timer("apply workspace"):
+        index = getShortenerIndex()
+        targets = []
+        for pane, field in zip(panes, fields):
+            path, cursor = splitPaneState(field)
+            path = index.expand(path)
+            if '://' not in path:
+                path = as_url(path)
+            targets.append((pane, path, cursor))
+        threads = []
+        for pane, url, cursor in targets:
+            thread = threading.Thread(target=applyPaneState, args=(pane, url, cursor))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+def applyPaneState(pane, url, cursor):
+    navigate(pane, url)
+    if cursor:
+        try:
+            pane.place_cursor_at(url.rstrip('/') + '/' + cursor)
+        except Exception:
+            pass
+
+#
+# Function:    migratePairsToWorkspaces
+#
+# Description: This function copies the favorite pairs into the
+#              workspaces the first time workspaces are used, so
+#              every pair is also a two pane workspace.
+#
+
+
+def migratePairsToWorkspaces():
+    if not os.path.exists(WORKSPACELIST):
+        WORKSPACES.rewrite(PAIRS.entries())
+
+#
+# Function:    GoToWorkspace
+#
+# Description: This class shows the saved workspaces in a
+#              quicksearch and moves all the panes to the one
+#              selected.
+#
+
+
+class GoToWorkspace(DirectoryPaneCommand):
+
+    def __call__(self):
+        migratePairsToWorkspaces()
+        show_status_message('Workspace Selection')
+        result = show_quicksearch(self._suggest_workspace)
+        if result:
+            query, name = result
+            entry = WORKSPACES.lookup(name)
+            if entry is not None:
+                applyWorkspace(self.pane.window.get_panes(), entry[1:])
+        clear_status_message()
+
+    def _suggest_workspace(self, query):
+        return suggestEntries("GoToWorkspace", WORKSPACES.entries(), query,
+                              stateEntry=self._state_workspace,
+                              keysEntry=self._keys_workspace)
+
+    def _paths(self, entry):
+        return [splitPaneState(field)[0] for field in entry[1:]]
+
+    def _keys_workspace(self, entry, index):
+        return frecencyKeys(index, self._paths(entry))
+
+    def _state_workspace(self, entry):
+        return VALIDATOR.worstState([favoriteUrl(path) for path in self._paths(entry)])
+
+#
+# Function:    SetWorkspace
+#
+# Description: This class saves the directories of all the panes
+#              and the file under the cursor in each of them as a
+#              workspace with a name from the user. A workspace
+#              with the same name is replaced.
+#
+
+
+class SetWorkspace(DirectoryPaneCommand):
+
+    def __call__(self):
+        migratePairsToWorkspaces()
+        name, checked = show_prompt("Name this Workspace:")
+        if not (checked and name):
+            return
+        fields = []
+        for pane in self.pane.window.get_panes():
+            field = shortenDirPath(as_human_readable(pane.get_path()))
+            cursor = pane.get_file_under_cursor()
+            if cursor:
+                field += PANESTATESEPARATOR + os.path.basename(as_human_readable(cursor))
+            fields.append(field)
+        WORKSPACES.append([name] + fields)
+
+#
+# Function:    RemoveWorkspace
+#
+# Description: This class removes the selected workspace.
+#
+
+
+class RemoveWorkspace(DirectoryPaneCommand):
+
+    def __call__(self):
+        migratePairsToWorkspaces()
+        show_status_message('Remove Workspace')
+        result = show_quicksearch(self._suggest_workspace)
+        if result:
+            query, name = result
+            WORKSPACES.remove(name)
+        clear_status_message()
+
+    def _suggest_workspace(self, query):
+        return suggestEntries("RemoveWorkspace", WORKSPACES.entries(), query)
 
 #
 # Function:    GoToFavoritePair
@@ -46,41 +1319,30 @@ class GoToFavoritePair(DirectoryPaneCommand):
         result = show_quicksearch(self._suggest_directory)
         if result:
             query, dirName = result
-            directories = ["Home|~|~"]
-            if os.path.isfile(FAVORITEPAIRS):
-                with open(FAVORITEPAIRS, "r") as f:
-                    directories = directories + f.readlines()
-            panes = self.pane.window.get_panes();
-            for dirTuple in directories:
-                if '|' in dirTuple:
-                    favName, favPath1, favPath2 = dirTuple.strip().split('|')[0:3]
-                    if favName == dirName:
-                        if '://' in favPath1:
-                            newPath = expandDirPath(favPath1)
-                            panes[0].set_path(newPath)
-                        else:
-                            newPath = as_url(expandDirPath(favPath1))
-                            panes[0].set_path(newPath)
-                        if '://' in favPath2:
-                            newPath = expandDirPath(favPath2)
-                            panes[1].set_path(newPath)
-                        else:
-                            newPath = as_url(expandDirPath(favPath2))
-                            panes[1].set_path(newPath)
-                        break
+            if dirName == "Home":
+                entry = ("Home", "~", "~")
+            else:
+                entry = PAIRS.lookup(dirName)
+            if entry is not None:
+                applyWorkspace(self.pane.window.get_panes(), entry[1:])
         clear_status_message()
 
     def _suggest_directory(self, query):
-        directories = ["Home|~|~"]
-        if os.path.isfile(FAVORITEPAIRS):
-            with open(FAVORITEPAIRS, "r") as f:
-                directories = directories + f.readlines()
-        for dirTuple in directories:
-            if '|' in dirTuple:
-                dirName = dirTuple.split('|')[0]
-                match = contains_chars(dirName.lower(), query.lower())
-                if match or not query:
-                    yield QuicksearchItem(dirName, highlight=match)
+        return prefetchFavorites(list(suggestEntries(
+            "GoToFavoritePair", PAIRS.entries(), query, (("Home", "~", "~"),),
+            stateEntry=self._state_pair, keysEntry=self._keys_pair)), self._urls_pair)
+
+    def _urls_pair(self, dirName):
+        entry = PAIRS.lookup(dirName)
+        if entry is None:
+            return []
+        return [favoriteUrl(entry[1]), favoriteUrl(entry[2])]
+
+    def _state_pair(self, entry):
+        return VALIDATOR.worstState([favoriteUrl(entry[1]), favoriteUrl(entry[2])])
+
+    def _keys_pair(self, entry, index):
+        return frecencyKeys(index, entry[1:3])
 
 #
 # Function:    GoToFavaorite
@@ -102,34 +1364,257 @@ class GoToFavorite(DirectoryPaneCommand):
         result = show_quicksearch(self._suggest_directory)
         if result:
             query, dirName = result
-            directories = ["Home|~"]
-            if os.path.isfile(FAVORITELIST):
-                with open(FAVORITELIST, "r") as f:
-                    directories = directories + f.readlines()
-            for dirTuple in directories:
-                if '|' in dirTuple:
-                    favName, favPath = dirTuple.strip().split('|')[0:2]
-                    if favName == dirName:
-                        if '://' in favPath:
-                            newPath = expandDirPath(favPath)
-                            self.pane.set_path(newPath)
-                        else:
-                            newPath = as_url(expandDirPath(favPath))
-                            self.pane.set_path(newPath)
-                        break
+            if dirName == "Home":
+                entry = ("Home", "~")
+            else:
+                entry = FAVORITES.lookup(dirName)
+            if entry is not None:
+                favName, favPath = entry
+                navigate(self.pane, favoriteUrl(favPath))
         clear_status_message()
 
     def _suggest_directory(self, query):
-        directories = ["Home|~"]
-        if os.path.isfile(FAVORITELIST):
-            with open(FAVORITELIST, "r") as f:
-                directories = directories + f.readlines()
-        for dirTuple in directories:
-            if '|' in dirTuple:
-                dirName = dirTuple.split('|')[0]
-                match = contains_chars(dirName.lower(), query.lower())
-                if match or not query:
-                    yield QuicksearchItem(dirName, highlight=match)
+        return prefetchFavorites(list(suggestEntries(
+            "GoToFavorite", FAVORITES.entries(), query, (("Home", "~"),),
+            stateEntry=self._state_favorite, keysEntry=self._keys_favorite)), self._urls_favorite)
+
+    def _urls_favorite(self, dirName):
+        if dirName == "Home":
+            return [favoriteUrl("~")]
+        entry = FAVORITES.lookup(dirName)
+        if entry is None:
+            return []
+        return [favoriteUrl(entry[1])]
+
+    def _state_favorite(self, entry):
+        return VALIDATOR.state(favoriteUrl(entry[1]))
+
+    def _keys_favorite(self, entry, index):
+        return frecencyKeys(index, entry[1:2])
+
+#
+# Function:    FavoritesFinder
+#
+# Description: This class keeps an index of the file and directory
+#              names under each favorite root. The index of a root
+#              maps every directory (relative to the root) to its
+#              mtime, the names in it, and those names lowercased
+#              and joined by newlines, so a search skips the
+#              directories without a match with one find and
+#              never lowercases a name again. A refresh walks the tree
+#              again but only lists a directory whose mtime has
+#              changed, so an unchanged tree costs one stat for
+#              each directory. The roots are walked in parallel on
+#              a pool of threads, each root stops after
+#              FINDMAXENTRIES names, and a walk stops early when
+#              its cancelled event is set. Complete indexes are
+#              saved in FINDINDEXDIR, one file for each root, so
+#              they are still there after restarting fman.
+#
+
+
+FINDWORKERS = 4
+FINDMAXENTRIES = 200000
+
+
+class FavoritesFinder:
+
+    def __init__(self, workers, indexDir):
+        self.workers = workers
+        self.indexDir = indexDir
+        self._indexes = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _indexFile(self, root):
+        import hashlib
+        return os.path.join(self.indexDir,
+                            hashlib.sha1(root.encode("utf-8")).hexdigest())
+
+    def _load(self, root):
+        with self._lock:
+            index = self._indexes.get(root)
+        if index is not None:
+            return index
+        index = {}
+        try:
+            with open(self._indexFile(root), "r") as f:
+                if f.readline().rstrip("\n") == root:
+                    for line in f:
+                        rel, mtime, dirs, files = json.loads(line)
+                        index[rel] = (mtime, dirs, files, lowerNames(dirs, files))
+        except (OSError, ValueError):
+            index = {}
+        return index
+
+    def _save(self, root, index):
+        try:
+            os.makedirs(self.indexDir, exist_ok=True)
+            atomicWriteLines(self._indexFile(root), [root] + [
+                json.dumps([rel, mtime, dirs, files])
+                for rel, (mtime, dirs, files, lowered) in index.items()])
+        except OSError:
+            pass
+
+    def _walk(self, root, cancelled):
+        old = self._load(root)
+        index = {}
+        changed = len(old) == 0
+        count = 0
+        stack = [""]
+        while stack and count < FINDMAXENTRIES:
+            if cancelled.is_set():
+                return index
+            rel = stack.pop()
+            path = os.path.join(root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                changed = True
+                continue
+            cached = old.get(rel)
+            if cached is not None and cached[0] == mtime:
+                mtime, dirs, files, lowered = cached
+            else:
+                changed = True
+                dirs = []
+                files = []
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                isDir = entry.is_dir(follow_symlinks=False)
+                            except OSError:
+                                isDir = False
+                            (dirs if isDir else files).append(entry.name)
+                except OSError:
+                    pass
+                lowered = lowerNames(dirs, files)
+            index[rel] = (mtime, dirs, files, lowered)
+            count += len(dirs) + len(files)
+            for name in dirs:
+                if not name.startswith("."):
+                    stack.append(os.path.join(rel, name))
+        changed = changed or len(index) != len(old)
+        with self._lock:
+            self._indexes[root] = index
+        if changed:
+            self._save(root, index)
+        return index
+
+    def refresh(self, roots, cancelled):
+        #
+        # This starts refreshing the index of every root and
+        # gives a future for each that is done with the index.
+        #
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers)
+        return dict((self._executor.submit(self._walk, root, cancelled), root)
+                    for root in roots)
+
+
+FINDER = FavoritesFinder(FINDWORKERS, FINDINDEXDIR)
+
+#
+# Function:    lowerNames
+#
+# Description: This function gives the names of a directory in the
+#              find index lowercased and joined by newlines.
+#
+
+
+def lowerNames(dirs, files):
+    return "\n".join(dirs + files).lower()
+
+#
+# Function:    favoriteRoots
+#
+# Description: This function gives the (name, path) of every
+#              favorite that is a local directory. A favorite
+#              under another favorite is left out, since its files
+#              are found under that one already.
+#
+
+
+def favoriteRoots():
+    index = getShortenerIndex()
+    roots = []
+    for name, path in FAVORITES.entries():
+        path = index.expand(path)
+        if '://' not in path:
+            roots.append((os.path.normpath(path), name))
+    roots.sort()
+    results = []
+    for path, name in roots:
+        if results and (path == results[-1][1] or
+                        path.startswith(results[-1][1].rstrip(os.sep) + os.sep)):
+            continue
+        results.append((name, path))
+    return results
+
+#
+# Function:    FindInFavorites
+#
+# Description: This class searches the names of the files and
+#              directories under all the favorites. The indexes of
+#              the favorites are refreshed in the background while
+#              the quicksearch is open, and the results of each
+#              favorite are shown as soon as its index is ready.
+#              Closing the quicksearch stops the walks. The panel
+#              goes to the directory of the chosen file with the
+#              cursor on it.
+#
+
+
+class FindInFavorites(DirectoryPaneCommand):
+
+    def __call__(self):
+        roots = favoriteRoots()
+        self.names = dict((path, name) for name, path in roots)
+        self.cancelled = threading.Event()
+        self.futures = FINDER.refresh([path for name, path in roots], self.cancelled)
+        show_status_message('Find in Favorites')
+        try:
+            result = show_quicksearch(self._suggest_file)
+        finally:
+            self.cancelled.set()
+            clear_status_message()
+        if result:
+            query, path = result
+            navigate(self.pane, as_url(os.path.dirname(path)))
+            try:
+                self.pane.place_cursor_at(as_url(path))
+            except Exception:
+                pass
+
+    def _suggest_file(self, query):
+        query = query.lower()
+        if not query:
+            return
+        from concurrent.futures import as_completed
+        count = 0
+        with STATS.timer("find in favorites"):
+            for future in as_completed(self.futures):
+                if self.cancelled.is_set():
+                    return
+                root = self.futures[future]
+                title = self.names[root] + ":"
+                for rel, (mtime, dirs, files, lowered) in future.result().items():
+                    if query not in lowered:
+                        continue
+                    for name, loweredName in zip(dirs + files, lowered.split("\n")):
+                        position = loweredName.find(query)
+                        if position < 0:
+                            continue
+                        relName = os.path.join(rel, name)
+                        start = len(title) + len(relName) - len(name) + position
+                        yield QuicksearchItem(os.path.join(root, relName), title + relName,
+                                              highlight=list(range(start, start + len(query))))
+                        count += 1
+                        if count >= MAXSUGGESTIONS:
+                            return
 
 #
 # Function:    RemoveFavoriteDirectoryPairs
@@ -145,137 +1630,364 @@ class RemoveFavoriteDirectoryPairs(DirectoryPaneCommand):
     # and deleting it.
     #
 
-    def __call__(self):
-        show_status_message('Remove Favorite Directory Pair')
-        result = show_quicksearch(self._suggest_favorite)
-        if result:
-            query, dirName = result
-            if os.path.isfile(FAVORITEPAIRS):
-                with open(FAVORITEPAIRS, "r") as f:
-                    directories = f.readlines()
-                with open(FAVORITEPAIRS, "w") as f:
-                    for dirTuple in directories:
-                        favName = dirTuple.split('|')[0]
-                        if favName != dirName:
-                            f.write(dirTuple)
-        clear_status_message()
+    def __call__(self):
+        show_status_message('Remove Favorite Directory Pair')
+        result = show_quicksearch(self._suggest_favorite)
+        if result:
+            query, dirName = result
+            PAIRS.remove(dirName)
+        clear_status_message()
+
+    def _suggest_favorite(self, query):
+        return suggestEntries("RemoveFavoriteDirectoryPairs", PAIRS.entries(), query)
+
+#
+# Function:    RemoveFavoriteDirectory
+#
+# Description: This class performs the function of
+#              removing a favorite directory.
+#
+
+
+class RemoveFavoriteDirectory(DirectoryPaneCommand):
+    #
+    # This directory command is for selecting a favorite
+    # and deleting it.
+    #
+
+    def __call__(self):
+        show_status_message('Remove Favorite Directory')
+        result = show_quicksearch(self._suggest_favorite)
+        if result:
+            query, dirName = result
+            FAVORITES.remove(dirName)
+        clear_status_message()
+
+    def _suggest_favorite(self, query):
+        return suggestEntries("RemoveFavoriteDirectory", FAVORITES.entries(), query)
+#
+# Function:    RemoveShortenerDirectory
+#
+# Description: This class performs the function of
+#              removing a shortener directory.
+#
+
+
+class RemoveShortenerDirectory(DirectoryPaneCommand):
+    #
+    # This directory command is for selecting a favorite
+    # and deleting it.
+    #
+
+    def __call__(self):
+        show_status_message('Remove Shortener Directory')
+        result = show_quicksearch(self._suggest_shortener)
+        if result:
+            #
+            # Remove the shortener from the list of shorteners
+            # and expand it in everything that uses it.
+            #
+            query, shortName = result
+            if SHORTENERS.lookup(shortName) is not None:
+                rewriteShortener(shortName)
+        clear_status_message()
+
+    def _suggest_shortener(self, query):
+        return suggestShorteners("RemoveShortenerDirectory", query)
+
+#
+# Function:    RenameShortenerDirectory
+#
+# Description: This class gives a shortener a new name. Every
+#              favorite and pair that uses the shortener is
+#              changed to the new name.
+#
+
+
+class RenameShortenerDirectory(DirectoryPaneCommand):
+
+    def __call__(self):
+        show_status_message('Rename Shortener Directory')
+        result = show_quicksearch(self._suggest_shortener)
+        if result:
+            query, shortName = result
+            if SHORTENERS.lookup(shortName) is not None:
+                newName, checked = show_prompt("New name for this Directory Shortener:", shortName)
+                if checked and newName and newName != shortName:
+                    if SHORTENERS.lookup(newName) is not None:
+                        show_alert("There already is a shortener named " + newName + ".")
+                    else:
+                        rewriteShortener(shortName, newName=newName)
+        clear_status_message()
+
+    def _suggest_shortener(self, query):
+        return suggestShorteners("RenameShortenerDirectory", query)
+
+#
+# Function:    MoveShortenerDirectory
+#
+# Description: This class points a shortener at the directory
+#              of the current pane. Favorites that use the
+#              shortener then go to the same place under the new
+#              directory.
+#
+
+
+class MoveShortenerDirectory(DirectoryPaneCommand):
+
+    def __call__(self):
+        show_status_message('Move Shortener Directory')
+        result = show_quicksearch(self._suggest_shortener)
+        if result:
+            query, shortName = result
+            if SHORTENERS.lookup(shortName) is not None:
+                rewriteShortener(shortName, newRoot=as_human_readable(self.pane.get_path()))
+        clear_status_message()
+
+    def _suggest_shortener(self, query):
+        return suggestShorteners("MoveShortenerDirectory", query)
+
+#
+# Function:    suggestShorteners
+#
+# Description: This function gives the quicksearch items for
+#              picking a shortener.
+#
+
+
+def suggestShorteners(key, query):
+    shorteners = SHORTENERS.entries()
+    defaults = ()
+    if not shorteners:
+        defaults = (("No shorteners are setup.",),)
+    return suggestEntries(key, shorteners, query, defaults)
+
+#
+# Function:    shortenedStores
+#
+# Description: This function gives the stores whose paths can
+#              contain a {{shortener}} placeholder.
+#
+
+
+def shortenedStores():
+    return [FAVORITES, PAIRS, HOTDIRS, WORKSPACES]
+
+#
+# Function:    rewriteShortener
+#
+# Description: This function removes, renames or re-roots a
+#              shortener. Removing it expands {{name}} to the
+#              shortener's directory and renaming it changes
+#              {{name}} to the new name, in every store that
+#              uses shorteners. Each store is streamed through
+#              the change once and replaced atomically. Moving
+#              it to a new root only changes the shortener list,
+#              since the stores keep the placeholder. A rename to
+#              a name that is already taken changes nothing.
+#
+
+
+def rewriteShortener(shortName, newName=None, newRoot=None):
+    entry = SHORTENERS.lookup(shortName)
+    if entry is None:
+        return
+    if newName is not None and SHORTENERS.lookup(newName) is not None:
+        return
+    shortPath = entry[1]
+    placeholder = "{{" + shortName + "}}"
+    if newName is not None:
+        replacement = "{{" + newName + "}}"
+    else:
+        replacement = shortPath
+
+    def rewritePath(path):
+        start = path.find(placeholder)
+        if start < 0:
+            return path
+        if newName is None:
+            return replacement + path[start + len(placeholder):]
+        return path[0:start] + replacement + path[start + len(placeholder):]
+
+    shorteners = []
+    for oldName, oldPath in SHORTENERS.entries():
+        if oldName == shortName:
+            if newRoot is not None:
+                shorteners.append((oldName, newRoot))
+            elif newName is not None:
+                shorteners.append((newName, oldPath))
+        else:
+            shorteners.append((oldName, oldPath))
+    if newRoot is None:
+        for store in shortenedStores():
+            store.rewritePaths(rewritePath)
+    SHORTENERS.rewrite(shorteners)
+
+#
+# Function:    mineShorteners
+#
+# Description: This function proposes shortener roots. It builds
+#              a tree of the path components of every path kept
+#              in the favorites, pairs, workspaces and hot dirs,
+#              and of the visited directories. Each directory in
+#              the tree gets the number of stored characters a
+#              shortener there would save: for every stored path
+#              under it that isn't already under a deeper
+#              shortener, the length it has now minus the length
+#              of {{name}} and the rest of the path. The visits
+#              under it break ties. It gives (saved, visits, root,
+#              name) tuples for the best roots that don't contain
+#              each other.
+#
+
 
-    def _suggest_favorite(self, query):
-        favorites = [""]
-        if os.path.isfile(FAVORITEPAIRS):
-            with open(FAVORITEPAIRS, "r") as f:
-                favorites = f.readlines()
-        for favTuple in favorites:
-            if '|' in favTuple:
-                favName = favTuple.split('|')[0]
-                match = contains_chars(favName.lower(), query.lower())
-                if match or not query:
-                    yield QuicksearchItem(favName, highlight=match)
+SUGGESTEDSHORTENERS = 10
+
+
+def storedPaths(index):
+    for store in (FAVORITES, PAIRS, WORKSPACES):
+        for entry in store.entries():
+            for field in entry[1:]:
+                yield index.expand(splitPaneState(field)[0])
+    for slot, path in HOTDIRS.entries():
+        yield index.expand(path)
+
+
+def mineShorteners(limit=SUGGESTEDSHORTENERS):
+    index = getShortenerIndex()
+    tree = {}
+
+    def addPath(path, stored):
+        parts = pathComponents(path)
+        found = index.match(parts)
+        covered = found[1] if found is not None else 0
+        shortened = len(index.shorten(path))
+        node = tree
+        length = len(parts[0])
+        for depth, part in enumerate(parts[1:], 2):
+            length += len(part) + 1
+            node = node.setdefault(part, {})
+            counts = node.setdefault(None, [0, 0, 0])
+            if not stored:
+                counts[2] += 1
+            elif depth > covered:
+                counts[0] += shortened - (len(path) - length)
+                counts[1] += 1
+
+    for path in storedPaths(index):
+        if '://' not in path:
+            addPath(os.path.normpath(path), True)
+    for path, score in FRECENCY.paths():
+        addPath(path, False)
+
+    candidates = []
+    stack = [(tree, "")]
+    while stack:
+        node, root = stack.pop()
+        for part, child in node.items():
+            if part is None:
+                continue
+            childRoot = root + os.sep + part
+            stack.append((child, childRoot))
+            removed, count, visits = child[None]
+            saved = removed - count * (len(part) + 4)
+            if saved > 0 and count > 1:
+                candidates.append((saved, visits, childRoot, part))
+    candidates.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+
+    names = set(index.paths)
+    results = []
+    for saved, visits, root, part in candidates:
+        if len(results) == limit:
+            break
+        if any(root.startswith(other + os.sep) or other.startswith(root + os.sep)
+               for otherSaved, otherVisits, other, otherName in results):
+            continue
+        name = part
+        number = 2
+        while name in names:
+            name = "%s%d" % (part, number)
+            number += 1
+        names.add(name)
+        results.append((saved, visits, root, name))
+    return results
 
 #
-# Function:    RemoveFavoriteDirectory
+# Function:    reshortenAll
 #
-# Description: This class performs the function of
-#              removing a favorite directory.
+# Description: This function adds shorteners and shortens every
+#              path in the stores again with the new index, in one
+#              streamed pass over each store. Paths that were
+#              saved before a shortener existed get shortened too.
 #
 
 
-class RemoveFavoriteDirectory(DirectoryPaneCommand):
-    #
-    # This directory command is for selecting a favorite
-    # and deleting it.
-    #
+def reshortenAll(shorteners):
+    oldIndex = getShortenerIndex()
+    SHORTENERS.extend(shorteners)
+    newIndex = getShortenerIndex()
 
-    def __call__(self):
-        show_status_message('Remove Favorite Directory')
-        result = show_quicksearch(self._suggest_favorite)
-        if result:
-            query, dirName = result
-            if os.path.isfile(FAVORITELIST):
-                with open(FAVORITELIST, "r") as f:
-                    directories = f.readlines()
-                with open(FAVORITELIST, "w") as f:
-                    for dirTuple in directories:
-                        favName = dirTuple.split('|')[0]
-                        if favName != dirName:
-                            f.write(dirTuple)
-        clear_status_message()
+    def rewritePath(field):
+        path, separator, rest = field.partition(PANESTATESEPARATOR)
+        if '://' in path:
+            return field
+        return newIndex.shorten(oldIndex.expand(path)) + separator + rest
+
+    for store in shortenedStores():
+        store.rewritePaths(rewritePath)
 
-    def _suggest_favorite(self, query):
-        favorites = [""]
-        if os.path.isfile(FAVORITELIST):
-            with open(FAVORITELIST, "r") as f:
-                favorites = f.readlines()
-        for favTuple in favorites:
-            if '|' in favTuple:
-                favName = favTuple.split('|')[0]
-                match = contains_chars(favName.lower(), query.lower())
-                if match or not query:
-                    yield QuicksearchItem(favName, highlight=match)
 #
-# Function:    RemoveShortenerDirectory
+# Function:    SuggestShortenerDirectories
 #
-# Description: This class performs the function of
-#              removing a shortener directory.
+# Description: This class shows the shortener roots found by
+#              mineShorteners with the characters each would save.
+#              Every root picked is named by the user, and the
+#              quicksearch is shown again for more. The picked
+#              shorteners are added and all the stores are
+#              shortened with them once the user is done.
 #
 
 
-class RemoveShortenerDirectory(DirectoryPaneCommand):
-    #
-    # This directory command is for selecting a favorite
-    # and deleting it.
-    #
+class SuggestShortenerDirectories(DirectoryPaneCommand):
 
     def __call__(self):
-        show_status_message('Remove Shortener Directory')
-        result = show_quicksearch(self._suggest_shortener)
-        if result:
-            #
-            # Remove the shortener from the list of
-            # shorteners.
-            #
-            query, shortName = result
-            shortenDir = ''
-            if os.path.isfile(SHORTENERLIST):
-                with open(SHORTENERLIST, "r") as f:
-                    directories = f.readlines()
-                with open(SHORTENERLIST, "w") as f:
-                    for dirTuple in directories:
-                        if '|' in dirTuple:
-                            shortenerName, shortDir = dirTuple.strip().split('|')[0:2]
-                            if shortenerName != shortName:
-                                f.write(dirTuple + '\n')
-                            else:
-                                shortenDir = shortDir
-            #
-            # Remove the shortener from all favorites.
-            #
-            if os.path.isfile(FAVORITELIST):
-                favorties = ["Home|~"]
-                with open(FAVORITELIST, "r") as f:
-                    favorties = f.readlines()
-                pattern = re.compile("\{\{" + shortName + "\}\}(.*)$")
-                with open(FAVORITELIST, "w") as f:
-                    for fav in favorties:
-                        if '|' in fav:
-                            favName, favPath = fav.strip().split('|')[0:2]
-                            match = pattern.search(favPath)
-                            if match:
-                                favPath = shortenDir + match.group(1)
-                            f.write(favName + "|" + favPath + "\n")
+        show_status_message('Looking for shortener directories...')
+        with STATS.timer("mine shorteners"):
+            self.suggestions = mineShorteners()
+        self.roots = tuple((root, saved) for saved, visits, root, name in self.suggestions)
         clear_status_message()
-
-    def _suggest_shortener(self, query):
-        shorteners = ["No shorteners are setup."]
-        if os.path.isfile(SHORTENERLIST):
-            with open(SHORTENERLIST, "r") as f:
-                shorteners = f.readlines()
-        for shortTuple in shorteners:
-            if shortTuple.strip() != "":
-                shortName = shortTuple.split('|')[0]
-                match = contains_chars(shortName.lower(), query.lower())
-                if match or not query:
-                    yield QuicksearchItem(shortName, highlight=match)
+        if not self.suggestions:
+            show_alert("There are no directories that would make good shorteners.")
+            return
+        chosen = []
+        while self.suggestions:
+            result = show_quicksearch(self._suggest_root)
+            if not result:
+                break
+            query, root = result
+            suggestion = next((suggestion for suggestion in self.suggestions
+                               if suggestion[2] == root), None)
+            if suggestion is None:
+                break
+            name, checked = show_prompt("Name this Directory Shortener:", suggestion[3])
+            if checked and name:
+                chosen.append((name, root))
+                self.suggestions.remove(suggestion)
+                self.roots = tuple(entry for entry in self.roots if entry[0] != root)
+        if chosen:
+            with STATS.timer("reshorten"):
+                reshortenAll(chosen)
+            show_status_message('Added %d shorteners.' % len(chosen), 5)
+
+    def _suggest_root(self, query):
+        return suggestEntries("SuggestShortenerDirectories", self.roots, query,
+                              scoreEntry=self._score_root, hintEntry=self._hint_root)
+
+    def _score_root(self, entry):
+        return entry[1]
+
+    def _hint_root(self, entry):
+        return "saves %d characters" % entry[1]
 
 #
 # Function:    SetFavoriteDirectoryPairs
@@ -303,29 +2015,13 @@ class SetFavoriteDirectoryPairs(DirectoryPaneCommand):
         favName, checked = show_prompt("Name this Favorite:")
 
         #
-        # Find and remove the name from favorites.
-        #
-        if os.path.isfile(FAVORITEPAIRS):
-            with open(FAVORITEPAIRS, "r") as f:
-                directories = f.readlines()
-            with open(FAVORITEPAIRS, "w") as f:
-                for dirTuple in directories:
-                    oldDirName = dirTuple.split('|')[0]
-                    if favName != oldDirName:
-                        f.write(dirTuple)
-
-        #
-        # Add name to favorites.
+        # Add name to favorites. This replaces a pair
+        # with the same name.
         #
         panes = self.pane.window.get_panes()
         dirName1 = shortenDirPath(panes[0].get_path())
         dirName2 = shortenDirPath(panes[1].get_path())
-        favEntry = favName + "|" + dirName1 + "|" + dirName2
-        writeappend = 'w'
-        if os.path.isfile(FAVORITEPAIRS):
-            writeappend = 'a'
-        with open(FAVORITEPAIRS, writeappend) as f:
-            f.write(favEntry + "\n")
+        PAIRS.append((favName, dirName1, dirName2))
 
 #
 # Function:    SetFavoriteDirectory
@@ -353,32 +2049,170 @@ class SetFavoriteDirectory(DirectoryPaneCommand):
 
         #
         # Add to the list of projects. Get a name
-        # from the user.
+        # from the user. Ask first if the directory,
+        # or the directory a link goes to, already is
+        # a favorite.
         #
+        favorite = favoriteForPath(dirName)
+        if favorite is not None:
+            if show_alert("This directory already is the favorite " + favorite +
+                          ". Add it again?", YES | NO, NO) != YES:
+                return
         dirName = shortenDirPath(dirName)
         favName, checked = show_prompt("Name this Favorite:")
 
         #
-        # Find and remove the name from favorites.
+        # Add name to favorites. This replaces a favorite
+        # with the same name.
+        #
+        FAVORITES.append((favName, dirName))
+
+#
+# Function:    ReversePathIndex
+#
+# Description: This class maps the expanded path of every
+#              favorite, pair member and workspace pane to the
+#              entries that point there, so finding what the
+#              current directory is takes one dictionary lookup.
+#              Paths are expanded with the shortener index, and
+#              also through the real directory of a shortener that
+#              is a link. Every path is indexed by its canonical
+#              path as well, so a directory is found both through
+#              a link and by its real path. The real directories
+#              of the parents are kept during an update, so a path
+#              only costs one lstat of its last component.
+#              The index is built on the watcher thread, and the
+#              paths each entry was added under are kept to
+#              remove it again.
+#
+#              update builds it the first time and after the
+#              shorteners change. Otherwise only the entries whose
+#              fields have changed since the last update are
+#              removed and added again, so a change to one
+#              favorite doesn't expand all the others. A store
+#              whose entries haven't changed is skipped with one
+#              identity check.
+#
+
+
+class ReversePathIndex:
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._paths = {}
+        self._entries = {}
+        self._added = {}
+        self._realDirs = {}
+        self._shortenerIndex = None
+        self._lock = threading.Lock()
+
+    def _canonical(self, path):
+        parent, name = os.path.split(path)
+        if not name or parent == path:
+            return os.path.realpath(path)
+        realParent = self._realDirs.get(parent)
+        if realParent is None:
+            realParent = self._canonical(parent)
+            self._realDirs[parent] = realParent
+        real = os.path.join(realParent, name)
+        if os.path.islink(real):
+            real = os.path.realpath(real)
+        return real
+
+    def _entryPaths(self, index, entry):
+        for field in entry[1:]:
+            for path in index.expandPaths(splitPaneState(field)[0]):
+                if '://' in path:
+                    scheme, path = splitscheme(path)
+                    if scheme != 'file://':
+                        continue
+                yield os.path.normpath(path)
+
+    def _add(self, index, kind, entry):
+        paths = []
+        for path in self._entryPaths(index, entry):
+            for indexed in (path, self._canonical(path)):
+                if indexed not in paths:
+                    paths.append(indexed)
+                    self._paths.setdefault(indexed, collections.OrderedDict())[(kind, entry[0])] = True
+        self._added[(kind, entry[0])] = paths
+
+    def _remove(self, kind, entry):
+        for path in self._added.pop((kind, entry[0]), ()):
+            names = self._paths.get(path)
+            if names is not None:
+                names.pop((kind, entry[0]), None)
+                if not names:
+                    del self._paths[path]
+
+    def update(self):
+        index = getShortenerIndex()
+        with self._lock:
+            if index is not self._shortenerIndex:
+                STATS.count("path index rebuild")
+                self._paths = {}
+                self._entries = {}
+                self._added = {}
+                self._shortenerIndex = index
+            self._realDirs = {}
+            for kind, store in self.sources:
+                entries = store.entries()
+                cached = self._entries.get(kind)
+                if cached is not None and cached[0] is entries:
+                    continue
+                oldEntries = cached[1] if cached is not None else {}
+                newEntries = dict((entry[0], entry) for entry in entries)
+                for name, entry in oldEntries.items():
+                    if newEntries.get(name) != entry:
+                        self._remove(kind, entry)
+                for name, entry in newEntries.items():
+                    if oldEntries.get(name) != entry:
+                        self._add(index, kind, entry)
+                self._entries[kind] = (entries, newEntries)
+
+    def lookup(self, path):
+        #
+        # This gives the (kind, name) of every entry for the
+        # path as the index is now, without updating it.
         #
-        if os.path.isfile(FAVORITELIST):
-            with open(FAVORITELIST, "r") as f:
-                directories = f.readlines()
-            with open(FAVORITELIST, "w") as f:
-                for dirTuple in directories:
-                    oldDirName = dirTuple.split('|')[0]
-                    if favName != oldDirName:
-                        f.write(dirTuple)
+        names = self._paths.get(os.path.normpath(path))
+        if names is None:
+            return []
+        return list(names)
 
+    def find(self, path):
         #
-        # Add name to favorites.
+        # This looks up the path and then its canonical path,
+        # so a directory is found through symbolic links.
         #
-        favEntry = favName + "|" + dirName
-        writeappend = 'w'
-        if os.path.isfile(FAVORITELIST):
-            writeappend = 'a'
-        with open(FAVORITELIST, writeappend) as f:
-            f.write(favEntry + "\n")
+        names = self.lookup(path)
+        if '://' not in path:
+            for name in self.lookup(CANONICAL.canonical(path)):
+                if name not in names:
+                    names.append(name)
+        return names
+
+
+PATHINDEX = ReversePathIndex([("Favorite", FAVORITES), ("Pair", PAIRS),
+                              ("Workspace", WORKSPACES)])
+
+#
+# Function:    favoriteForPath
+#
+# Description: This function gives the name of the favorite for a
+#              directory, or None when it isn't one. A directory
+#              that isn't found as it is given is looked up again
+#              by its canonical path, so a favorite is also found
+#              through symbolic links.
+#
+
+
+def favoriteForPath(path):
+    PATHINDEX.update()
+    for kind, name in PATHINDEX.find(path):
+        if kind == "Favorite":
+            return name
+    return None
 
 #
 # Function:    SetShortenDirectory
@@ -414,12 +2248,388 @@ class SetShortenDirectory(DirectoryPaneCommand):
             # from the user.
             #
             shortener, checked = show_prompt("Name this Directory Shortener:")
-            shortEntry = shortener + "|" + dirName
-            writeappend = 'w'
-            if os.path.isfile(SHORTENERLIST):
-                writeappend = 'a'
-            with open(SHORTENERLIST, writeappend) as f:
-                f.write(shortEntry + "\n")
+            SHORTENERS.append((shortener, dirName))
+
+#
+# Function:    pathComponents
+#
+# Description: This function splits a path into the list of
+#              its normalized components. The drive (if any) is
+#              kept as the first component so that paths on
+#              different drives never share a prefix. With
+#              normalize off the case is kept, for building paths
+#              from the components again.
+#
+
+
+def pathComponents(dir, normalize=True):
+    path = os.path.abspath(dir)
+    if normalize:
+        path = os.path.normcase(path)
+    drive, rest = os.path.splitdrive(path)
+    return [drive] + [part for part in rest.split(os.sep) if part]
+
+#
+# Function:    CanonicalPaths
+#
+# Description: This class is a cache of the canonical paths of
+#              directories, with the symbolic links (like the
+#              Dropbox links from the README) resolved. It keeps
+#              the CANONICALCACHESIZE paths used last. A cached
+#              path is used without any system call for
+#              CANONICALTTL seconds. After that one stat of the
+#              path tells whether it still is the same directory
+#              (same device, inode and modification time), and
+#              only when it isn't is realpath, with a system call
+#              for every component, run again.
+#
+
+
+CANONICALCACHESIZE = 4096
+CANONICALTTL = 30
+
+
+class CanonicalPaths:
+
+    def __init__(self, size):
+        self.size = size
+        self._paths = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _statKey(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    def canonical(self, path):
+        now = time.time()
+        with self._lock:
+            cached = self._paths.get(path)
+            if cached is not None:
+                self._paths.move_to_end(path)
+                if now < cached[2]:
+                    STATS.count("canonical hit")
+                    return cached[0]
+        statKey = self._statKey(path)
+        if cached is not None and statKey is not None and statKey == cached[1]:
+            STATS.count("canonical hit")
+            real = cached[0]
+        else:
+            STATS.count("canonical miss")
+            real = os.path.realpath(path)
+        with self._lock:
+            self._paths[path] = (real, statKey, now + CANONICALTTL)
+            self._paths.move_to_end(path)
+            while len(self._paths) > self.size:
+                self._paths.popitem(last=False)
+        return real
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+
+
+CANONICAL = CanonicalPaths(CANONICALCACHESIZE)
+
+#
+# Function:    ShortenerIndex
+#
+# Description: This class is a compiled form of the shortener
+#              list. Shortener roots are kept in a tree keyed by
+#              path components, so finding the longest shortener
+#              for a path is a single walk down that path. The
+#              shortener names are kept in a dictionary for
+#              expanding a {{name}} placeholder.
+#
+#              Each root is also kept under its canonical path. A
+#              path that no shortener contains as it is given is
+#              looked up again by its canonical path, so reaching
+#              a shortener's directory through a symbolic link, or
+#              its real directory when the shortener is a link,
+#              still gives the shortener.
+#
+
+
+class ShortenerIndex:
+
+    def __init__(self, shorteners, homeDir):
+        self.shorteners = shorteners
+        self.paths = {}
+        self.realPaths = {}
+        self.tree = {}
+        for shortName, shortPath in shorteners:
+            self.paths.setdefault(shortName, shortPath)
+            self._insert(shortPath, "{{" + shortName + "}}")
+        self._insert(homeDir, "~")
+        for shortName, shortPath in shorteners:
+            realPath = CANONICAL.canonical(os.path.expanduser(shortPath))
+            if realPath != os.path.abspath(os.path.expanduser(shortPath)):
+                self.realPaths.setdefault(shortName, realPath)
+                self._insert(realPath, "{{" + shortName + "}}")
+
+    def _insert(self, dir, placeholder):
+        node = self.tree
+        for part in pathComponents(dir):
+            node = node.setdefault(part, {})
+        node.setdefault(None, placeholder)
+
+    def match(self, parts):
+        node = self.tree
+        found = None
+        for depth, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], depth + 1)
+        return found
+
+    def shorten(self, dir):
+        if '://' in dir:
+            return dir
+        found = self.match(pathComponents(dir))
+        if found is None or found[0] == "~":
+            realDir = CANONICAL.canonical(dir)
+            realFound = self.match(pathComponents(realDir))
+            if realFound is not None and realFound[0] != "~":
+                dir, found = realDir, realFound
+        if found is None:
+            return dir
+        placeholder, depth = found
+        #
+        # The parts are matched normalized, but the rest of the
+        # path keeps its case.
+        #
+        rest = pathComponents(dir, False)[depth:]
+        if not rest:
+            return placeholder + "/."
+        return placeholder + "/" + os.path.join(*rest)
+
+    def expand(self, dir):
+        start = dir.find("{{")
+        if start >= 0:
+            end = dir.rfind("}}")
+            if end > start:
+                shortPath = self.paths.get(dir[start + 2:end])
+                if shortPath is not None:
+                    dir = shortPath + dir[end + 2:]
+        return os.path.expanduser(dir)
+
+    def expandPaths(self, dir):
+        #
+        # This gives the expanded path, and the path through the
+        # real directory of the shortener when it is a link.
+        #
+        paths = [self.expand(dir)]
+        start = dir.find("{{")
+        if start >= 0:
+            end = dir.rfind("}}")
+            realPath = self.realPaths.get(dir[start + 2:end])
+            if end > start and realPath is not None:
+                paths.append(realPath + dir[end + 2:])
+        return paths
+
+
+SHORTENERINDEX = None
+
+#
+# Function:    getShortenerIndex
+#
+# Description: This function returns the compiled shortener
+#              index. It is only rebuilt when the shortener file
+#              has changed since the last time it was built.
+#
+
+
+def getShortenerIndex():
+    global SHORTENERINDEX
+    shorteners = SHORTENERS.entries()
+    index = SHORTENERINDEX
+    if index is None or index.shorteners is not shorteners:
+        STATS.count("shortener index miss")
+        index = ShortenerIndex(shorteners, HOMEDIR)
+        SHORTENERINDEX = index
+    else:
+        STATS.count("shortener index hit")
+    return index
+
+#
+# Function:    ImportFavoritesText
+#
+# Description: This class reads the text files of favorites and
+#              favorite pairs into the store that is in use. This
+#              is used to pick up changes made to the text files
+#              (by Dropbox or the Alfred workflow) when using the
+#              SQLite backend.
+#
+
+
+class ImportFavoritesText(DirectoryPaneCommand):
+
+    def __call__(self):
+        if isinstance(FAVORITES.store(), FavoritesStore):
+            show_alert('The favorites are already stored in the text files.')
+            return
+        for store, fileName in ((FAVORITES, FAVORITELIST), (PAIRS, FAVORITEPAIRS)):
+            store.rewrite(FavoritesStore(fileName, store.fieldCount).entries())
+        show_status_message('Favorites imported from text files.', 5)
+
+#
+# Function:    ExportFavoritesText
+#
+# Description: This class writes the favorites and favorite
+#              pairs of the store that is in use to the text
+#              files, so that the Alfred workflow and Dropbox
+#              syncing keep working with the SQLite backend.
+#
+
+
+class ExportFavoritesText(DirectoryPaneCommand):
+
+    def __call__(self):
+        if isinstance(FAVORITES.store(), FavoritesStore):
+            show_alert('The favorites are already stored in the text files.')
+            return
+        for store, fileName in ((FAVORITES, FAVORITELIST), (PAIRS, FAVORITEPAIRS)):
+            FavoritesStore(fileName, store.fieldCount).rewrite(store.entries())
+        show_status_message('Favorites exported to text files.', 5)
+
+#
+# Function:    importFavorites
+#
+# Description: This function adds favorites for a stream of paths.
+#              Paths are compared after normalizing them, so a
+#              path that is already a favorite or came earlier in
+#              the stream is left out, and so is a path with a "|"
+#              in it, which the files can't hold. Each path is
+#              shortened with the same shortener index and named
+#              after its last directory, with a number added when
+#              the name is taken. The store is written once at the
+#              end. It gives the number of favorites added.
+#
+
+
+def importFavorites(paths):
+    index = getShortenerIndex()
+    entries = FAVORITES.entries()
+    names = set(entry[0] for entry in entries)
+    seen = set(os.path.normpath(index.expand(entry[1])) for entry in entries)
+    numbers = {}
+    added = []
+    with STATS.timer("import favorites"):
+        for path in paths:
+            path = os.path.normpath(os.path.expanduser(path.strip()))
+            if not os.path.isabs(path) or '|' in path or path in seen:
+                continue
+            seen.add(path)
+            baseName = os.path.basename(path) or path
+            name = baseName
+            number = numbers.get(baseName, 2)
+            while name in names:
+                name = "%s %d" % (baseName, number)
+                number += 1
+            numbers[baseName] = number
+            names.add(name)
+            added.append((name, index.shorten(path)))
+        FAVORITES.extend(added)
+    return len(added)
+
+#
+# Function:    ImportFavorites
+#
+# Description: This class asks for a tool to import favorites from
+#              (zoxide, autojump, z, CDPATH, GTK bookmarks or a
+#              list of paths) and where its data is, and adds a
+#              favorite for each of its directories.
+#
+
+
+class ImportFavorites(DirectoryPaneCommand):
+
+    def __call__(self):
+        from .importers import IMPORTERS
+        self.importers = tuple(IMPORTERS)
+        result = show_quicksearch(self._suggest_importer)
+        if not result:
+            return
+        query, name = result
+        for importerName, reader, fileName in IMPORTERS:
+            if importerName == name:
+                break
+        else:
+            return
+        if fileName is None:
+            source = os.environ.get(name, "")
+        else:
+            fileName, checked = show_prompt("Import " + name + " from:", fileName)
+            if not (checked and fileName):
+                return
+            source = os.path.expanduser(fileName)
+            if not os.path.isfile(source):
+                show_alert("There is no file " + fileName + ".")
+                return
+        show_status_message('Importing favorites from ' + name + '...')
+        count = importFavorites(reader(source))
+        show_status_message('Imported %d favorites from %s.' % (count, name), 5)
+
+    def _suggest_importer(self, query):
+        return suggestEntries("ImportFavorites", self.importers, query)
+
+#
+# Function:    ExportFavorites
+#
+# Description: This class writes the favorites to a file the user
+#              gives, in the name|path format that the Alfred
+#              workflow reads, with the shorteners expanded.
+#
+
+
+class ExportFavorites(DirectoryPaneCommand):
+
+    def __call__(self):
+        fileName, checked = show_prompt("Export the favorites to:",
+                                        os.path.join(HOMEDIR, "favorites.txt"))
+        if not (checked and fileName):
+            return
+        index = getShortenerIndex()
+        entries = FAVORITES.entries()
+        atomicWriteLines(os.path.expanduser(fileName),
+                         (name + "|" + index.expand(path) for name, path in entries))
+        show_status_message('Exported %d favorites to %s.' % (len(entries), fileName), 5)
+
+#
+# Function:    ShowFavoritesPerformanceStats
+#
+# Description: This class shows a summary of the timings and
+#              cache hit rates the plugin has recorded, to tell
+#              whether slow favorites come from the disk, the
+#              parsing or the target file system.
+#
+
+
+class ShowFavoritesPerformanceStats(DirectoryPaneCommand):
+
+    def __call__(self):
+        show_alert(STATS.report())
+
+#
+# Function:    DumpFavoritesPerformanceStats
+#
+# Description: This class writes the recorded timings, counters
+#              and raw samples to a JSON file.
+#
+
+
+class DumpFavoritesPerformanceStats(DirectoryPaneCommand):
+
+    def __call__(self):
+        fileName, checked = show_prompt("Write the performance stats to:",
+                                        os.path.join(HOMEDIR, "favorites-stats.json"))
+        if checked and fileName:
+            STATS.dump(os.path.expanduser(fileName))
+            show_status_message('Performance stats written to ' + fileName, 5)
 
 #
 # Function:    expandDirPath
@@ -433,88 +2643,57 @@ class SetShortenDirectory(DirectoryPaneCommand):
 
 
 def expandDirPath(dir):
-    dirName = dir
-    pattern = re.compile("\{\{(.*)\}\}")
-    match = pattern.search(dir)
-    if match:
-        if os.path.isfile(SHORTENERLIST):
-            with open(SHORTENERLIST, "r") as f:
-                shorteners = f.readlines()
-                for shortener in shorteners:
-                    shortName, shortPath = shortener.strip().split('|')
-                    if match.group(1) == shortName:
-                        dirName = shortPath + dir[match.end(1) + 2:]
-    return os.path.expanduser(dirName)
+    start = time.perf_counter()
+    path = getShortenerIndex().expand(dir)
+    STATS.tally("expand path", time.perf_counter() - start)
+    return path
 
 #
 # Function:    shortenDirPath
 #
 # Description: This function takes a diretory path. It looks for
-#              that path to be a shortener directory. If it is, it
-#              shortens it to that directory. Otherwise, it makes
-#              the path relative to the Home directory if it is
-#              a child directory of the home directory.
+#              the longest shortener directory that contains the
+#              path. If there is one, it shortens it to that
+#              directory. Otherwise, it makes the path relative to
+#              the Home directory if it is a child directory of
+#              the home directory.
 #
 
 
 def shortenDirPath(dir):
-    dirName = dir
-    if os.path.isfile(SHORTENERLIST):
-        with open(SHORTENERLIST, "r") as f:
-            shorteners = f.readlines()
-            for shortener in shorteners:
-                pathName, path = shortener.strip().split('|')
-                if path_is_parent(path, dirName):
-                    dirName = "{{" + pathName + "}}/" + \
-                        os.path.relpath(dirName, path)
-    if path_is_parent(os.path.expanduser("~"), dirName):
-        dirName = '~/' + os.path.relpath(dirName, os.path.expanduser("~"))
-    return dirName
-
-#
-# The following function was taken from
-# [StackOverflow](https://stackoverflow.com/questions/3812849/how-to-check-whether-a-directory-is-a-sub-directory-of-another-directory)
-#
-
-
-def path_is_parent(parent_path, child_path):
-    # Smooth out relative path names, note:
-    # if you are concerned about symbolic links,
-    # you should use os.path.realpath too
-    parent_path = os.path.abspath(parent_path)
-    child_path = os.path.abspath(child_path)
-
-    # Compare the drive of the parent and child
-    # path. This is added because commonpath does
-    # not work on paths on different drives.
-    [parent_drive, _] = os.path.splitdrive(parent_path)
-    [child_drive, _] = os.path.splitdrive(child_path)
-    if parent_drive != child_drive:
-        return False
+    start = time.perf_counter()
+    path = getShortenerIndex().shorten(dir)
+    STATS.tally("shorten path", time.perf_counter() - start)
+    return path
+
+#
+# Function:    hotDirSlot
+#
+# Description: This function gives the slot a hot dir command
+#              works on: the name when one is given, otherwise
+#              the number. Negative numbers use slot 0.
+#
 
-    # Compare the common path of the parent and
-    # child path with the common path of just the
-    # parent path. Using the commonpath method on
-    # just the parent path will regularise the
-    # path name in the same way as the comparison
-    # that deals with both paths, removing any
-    # trailing path separator
-    return os.path.commonpath([parent_path]) == os.path.commonpath([parent_path, child_path])
+
+def hotDirSlot(dirNum, name):
+    if name:
+        return name
+    if dirNum < 0:
+        dirNum = 0
+    return str(dirNum)
 
 #
 # Function:    SetHotDir
 #
-# Description: This class performs the operation of going
-#              to the specified directory stored in memory.
+# Description: This class stores the current directory in
+#              the hot dir slot given by dirNum (or name).
 #
 
 
 class SetHotDir(DirectoryPaneCommand):
 
-    def __call__(self, dirNum=0):
-        if dirNum < 0 or dirNum > 4:
-            dirNum = 0
-        HOTLIST[dirNum] = as_human_readable(self.pane.get_path())
+    def __call__(self, dirNum=0, name=None):
+        HOTDIRS.set(hotDirSlot(dirNum, name), as_human_readable(self.pane.get_path()))
 
 #
 # Function:    GoToHotDir
@@ -526,18 +2705,592 @@ class SetHotDir(DirectoryPaneCommand):
 
 class GoToHotDir(DirectoryPaneCommand):
 
-    def __call__(self, dirNum=0):
-        if dirNum < 0 or dirNum > 4:
-            dirNum = 0
-        self.pane.set_path(as_url(expandDirPath(HOTLIST[dirNum])))
+    def __call__(self, dirNum=0, name=None):
+        navigate(self.pane, favoriteUrl(HOTDIRS.get(hotDirSlot(dirNum, name))))
+
+#
+# Function:    SetNamedHotDir
+#
+# Description: This class asks for a name and stores the
+#              current directory in the hot dir slot with that
+#              name.
+#
+
+
+class SetNamedHotDir(DirectoryPaneCommand):
+
+    def __call__(self):
+        name, checked = show_prompt("Name this Hot Dir:")
+        if checked and name:
+            HOTDIRS.set(name, as_human_readable(self.pane.get_path()))
+
+#
+# Function:    GoToHotDirSlot
+#
+# Description: This class shows all the hot dir slots in a
+#              quicksearch, including the ones without a key
+#              binding, and goes to the one selected.
+#
+
+
+class GoToHotDirSlot(DirectoryPaneCommand):
+
+    def __call__(self):
+        show_status_message('Hot Dir Selection')
+        result = show_quicksearch(self._suggest_slot)
+        if result:
+            query, slot = result
+            navigate(self.pane, favoriteUrl(HOTDIRS.get(slot)))
+        clear_status_message()
+
+    def _suggest_slot(self, query):
+        return suggestEntries("GoToHotDirSlot", HOTDIRS.entries(), query)
+
+#
+# Function:    DelayedCall
+#
+# Description: This class batches calls to a function. The first
+#              schedule() starts a timer thread and any further
+#              schedule() before it runs is folded into the same
+#              call. flushNow() runs a pending call right away.
+#
+
+
+class DelayedCall:
+
+    def __init__(self, delay, function):
+        self.delay = delay
+        self.function = function
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        self.function()
+
+    def flushNow(self):
+        with self._lock:
+            timer = self._timer
+            self._timer = None
+        if timer is not None:
+            timer.cancel()
+            self.function()
+
+#
+# Function:    HotDirs
+#
+# Description: This class keeps the hot dir slots. A slot is a
+#              number (the ones bound to keys) or a name, and
+#              holds a path in its shortened {{shortener}} form.
+#              Setting and going to a slot only uses memory. The
+#              slots are written to HOTDIRLIST shortly after they
+#              change, by a timer thread, and loaded on the
+#              watcher thread when fman starts.
+#
 
 
+HOTDIRFLUSHDELAY = 2
+
+
+class HotDirs:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self._slots = {}
+        self._entries = None
+        self._loaded = False
+        self._flusher = DelayedCall(HOTDIRFLUSHDELAY, self.save)
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._loaded:
+            return
+        slots = {}
+        if os.path.isfile(self.fileName):
+            with open(self.fileName, "r") as f:
+                for line in f:
+                    if '|' in line:
+                        slot, path = line.strip().split('|', 1)
+                        slots[slot] = path
+        with self._lock:
+            if not self._loaded:
+                slots.update(self._slots)
+                self._slots = slots
+                self._entries = None
+                self._loaded = True
+
+    def get(self, slot):
+        self.load()
+        return self._slots.get(slot, "~")
+
+    def set(self, slot, path):
+        path = shortenDirPath(path)
+        with self._lock:
+            self._slots[slot] = path
+            self._entries = None
+        self._flusher.schedule()
+
+    def entries(self):
+        self.load()
+        with self._lock:
+            if self._entries is None:
+                self._entries = tuple(sorted(self._slots.items()))
+            return self._entries
+
+    def rewritePaths(self, rewritePath):
+        self.load()
+        with self._lock:
+            for slot, path in list(self._slots.items()):
+                self._slots[slot] = rewritePath(path)
+            self._entries = None
+        self._flusher.schedule()
+
+    def save(self):
+        self.load()
+        with self._lock:
+            lines = [slot + "|" + path for slot, path in sorted(self._slots.items())]
+        atomicWriteLines(self.fileName, lines)
+
+    def flushPending(self):
+        self._flusher.flushNow()
+
+
+HOTDIRS = HotDirs(HOTDIRLIST)
+atexit.register(HOTDIRS.flushPending)
+
+#
+# Function:    FrecencyTable
+#
+# Description: This class keeps a score for every directory that
+#              is visited. Each visit adds one to the score and
+#              the score halves every FRECENCYHALFLIFE seconds, so
+#              often and recently visited directories score the
+#              highest. Visits are only queued in memory when they
+#              are recorded. A timer thread merges them into the
+#              table and appends them to the visit log in one
+#              batch. Once the log has more than VISITCOMPACTLINES
+#              lines, the table is written out as the compacted
+#              index (one line per directory) and the log is
+#              emptied. Loading reads the index and replays the
+#              log on top of it. It is loaded on the watcher thread
+#              and ready is set once it has been.
+#
+#              Every merge of visits increases version and keeps
+#              the keys it changed for the last FRECENCYCHANGES
+#              versions, so a matcher can find out which of its
+#              scores are out of date with changes. Go To Recent
+#              Directory keeps one list of all the directories
+#              sorted by score from rankedPaths, and only the
+#              directories visited since it was sorted are ranked
+#              again on top of it. The list is sorted again once
+#              the changes can't be told or more than
+#              FRECENCYRECENT directories have changed.
+#
+
+
+FRECENCYHALFLIFE = 7 * 24 * 60 * 60
+FRECENCYFLUSHDELAY = 30
+FRECENCYMAXENTRIES = 250000
+VISITCOMPACTLINES = 10000
+FRECENCYCHANGES = 256
+FRECENCYRECENT = 500
+
+
+class FrecencyTable:
+
+    def __init__(self, fileName, logName):
+        self.fileName = fileName
+        self.logName = logName
+        self.version = 0
+        self.ready = False
+        self._scores = {}
+        self._changes = collections.deque(maxlen=FRECENCYCHANGES)
+        self._pending = []
+        self._unlogged = []
+        self._logLines = 0
+        self._loaded = False
+        self._ranked = None
+        self._rankedChanges = None
+        self._flusher = DelayedCall(FRECENCYFLUSHDELAY, self.flush)
+        self._lock = threading.Lock()
+        self._ioLock = threading.Lock()
+
+    def key(self, path):
+        if '://' in path:
+            return path
+        return os.path.normpath(path)
+
+    def _decay(self, score, stamp, now):
+        return score * 0.5 ** ((now - stamp) / FRECENCYHALFLIFE)
+
+    def _add(self, scores, key, stamp):
+        score, lastStamp = scores.get(key, (0.0, stamp))
+        scores[key] = (self._decay(score, lastStamp, stamp) + 1.0, stamp)
+
+    def record(self, path):
+        #
+        # This is called on every directory change. It must not
+        # do any file I/O.
+        #
+        with self._lock:
+            self._pending.append((path, time.time()))
+        self._flusher.schedule()
+
+    def load(self):
+        if self._loaded:
+            return
+        with self._ioLock:
+            if self._loaded:
+                return
+            scores = {}
+            if os.path.isfile(self.fileName):
+                with open(self.fileName, "r") as f:
+                    for line in f:
+                        fields = line.strip().rsplit('|', 2)
+                        if len(fields) == 3:
+                            try:
+                                scores[fields[0]] = (float(fields[1]), float(fields[2]))
+                            except ValueError:
+                                pass
+            logLines = 0
+            if os.path.isfile(self.logName):
+                with open(self.logName, "r") as f:
+                    for line in f:
+                        fields = line.strip().split('|', 1)
+                        if len(fields) == 2:
+                            try:
+                                self._add(scores, fields[1], float(fields[0]))
+                                logLines += 1
+                            except ValueError:
+                                pass
+            with self._lock:
+                self._scores = scores
+                self._logLines = logLines
+                self._loaded = True
+                self.version += 1
+                self._changes.append((self.version, None))
+                self.ready = True
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = set()
+        for path, stamp in self._pending:
+            key = self.key(path)
+            self._add(self._scores, key, stamp)
+            self._unlogged.append((key, stamp))
+            keys.add(key)
+        self._pending = []
+        self.version += 1
+        self._changes.append((self.version, keys))
+
+    def changes(self, version):
+        #
+        # This gives the current version and the keys changed
+        # since the given one, or None for the keys when that
+        # is too long ago or all the scores changed.
+        #
+        self.load()
+        with self._lock:
+            self._merge()
+            return self.version, self._changedSince(version)
+
+    def _changedSince(self, version):
+        if version == self.version:
+            return set()
+        if version is None or not self._changes or self._changes[0][0] > version + 1:
+            return None
+        keys = set()
+        for changeVersion, changed in self._changes:
+            if changeVersion > version:
+                if changed is None:
+                    return None
+                keys.update(changed)
+        return keys
+
+    def scoreKeys(self, keys, reference):
+        #
+        # This gives the total score of the keys decayed to the
+        # reference time. Scores for the same reference time
+        # keep their order as time goes on.
+        #
+        total = 0.0
+        with self._lock:
+            for key in keys:
+                entry = self._scores.get(key)
+                if entry is not None:
+                    total += self._decay(entry[0], entry[1], reference)
+        return total
+
+    def score(self, path):
+        self.load()
+        with self._lock:
+            self._merge()
+            entry = self._scores.get(self.key(path))
+        if entry is None:
+            return 0.0
+        return self._decay(entry[0], entry[1], time.time())
+
+    def paths(self):
+        #
+        # This gives a (path, score) tuple for every directory
+        # that has been visited.
+        #
+        self.load()
+        with self._lock:
+            self._merge()
+            now = time.time()
+            return tuple((key, self._decay(score, stamp, now))
+                         for key, (score, stamp) in self._scores.items())
+
+    def rankedPaths(self):
+        #
+        # This gives (paths, changed, keys). paths has a (path,
+        # score) tuple for every directory, highest score first,
+        # as it was when it was last sorted. changed has the
+        # directories visited since then, highest score first,
+        # and keys their paths, whose entries in paths are out
+        # of date. All the scores are decayed to the time paths
+        # was sorted, so they can be compared with each other.
+        #
+        self.load()
+        with self._lock:
+            self._merge()
+            ranked = self._ranked
+            keys = None if ranked is None else self._changedSince(ranked[0])
+            if keys is None or len(keys) > FRECENCYRECENT:
+                now = time.time()
+                ranked = (self.version, now, tuple(sorted(
+                    ((key, self._decay(score, stamp, now))
+                     for key, (score, stamp) in self._scores.items()),
+                    key=lambda path: path[1], reverse=True)))
+                self._ranked = ranked
+                keys = set()
+            changes = self._rankedChanges
+            if changes is None or changes[0] != (ranked[0], self.version):
+                changed = []
+                for key in keys:
+                    entry = self._scores.get(key)
+                    if entry is not None:
+                        changed.append((key, self._decay(entry[0], entry[1], ranked[1])))
+                changed.sort(key=lambda path: path[1], reverse=True)
+                changes = ((ranked[0], self.version), tuple(changed), frozenset(keys))
+                self._rankedChanges = changes
+        return ranked[2], changes[1], changes[2]
+
+    def flush(self):
+        self.load()
+        with self._ioLock:
+            with self._lock:
+                self._merge()
+                visits = self._unlogged
+                self._unlogged = []
+                self._logLines += len(visits)
+                compact = self._logLines > VISITCOMPACTLINES
+                if compact:
+                    now = time.time()
+                    scores = [(self._decay(score, stamp, now), key)
+                              for key, (score, stamp) in self._scores.items()]
+                    if len(scores) > FRECENCYMAXENTRIES:
+                        scores = heapq.nlargest(FRECENCYMAXENTRIES, scores)
+                        self._scores = dict((key, (score, now)) for score, key in scores)
+                        self.version += 1
+                        self._changes.append((self.version, None))
+                    self._logLines = 0
+            if compact:
+                atomicWriteLines(self.fileName, (key + "|" + repr(score) + "|" + repr(now)
+                                                 for score, key in scores))
+                atomicWriteLines(self.logName, [])
+            elif visits:
+                with open(self.logName, "a") as f:
+                    for key, stamp in visits:
+                        f.write(repr(stamp) + "|" + key + "\n")
+
+    def flushPending(self):
+        self._flusher.flushNow()
+
+
+FRECENCY = FrecencyTable(FRECENCYLIST, VISITLOG)
+atexit.register(FRECENCY.flushPending)
+
+#
+# Function:    PaneHistory
+#
+# Description: This class is the navigation history of one pane.
+#              It is a ring buffer of at most depth directories,
+#              so any entry is reached by index in constant time.
+#              The cursor is the entry the pane is showing. Going
+#              back and forward moves the cursor. Visiting a new
+#              directory drops the entries after the cursor, and
+#              visiting the directory at the cursor again is
+#              ignored.
+#
+
+
+class PaneHistory:
+
+    def __init__(self, depth):
+        self.depth = max(1, depth)
+        self.cursor = -1
+        self.navigating = None
+        self._items = [None] * self.depth
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self._count:
+            raise IndexError(index)
+        return self._items[(self._start + index) % self.depth]
+
+    def items(self):
+        return [self[index] for index in range(self._count)]
+
+    def visit(self, path):
+        if self.cursor >= 0 and self[self.cursor] == path:
+            return
+        self._count = self.cursor + 1
+        if self._count == self.depth:
+            self._start = (self._start + 1) % self.depth
+            self._count -= 1
+        self._items[(self._start + self._count) % self.depth] = path
+        self._count += 1
+        self.cursor = self._count - 1
+
+    def move(self, steps):
+        target = self.cursor + steps
+        if target < 0 or target >= self._count or steps == 0:
+            return None
+        self.cursor = target
+        return self[target]
+
 #
-# Globals for PopDir functionality.
+# Function:    NavigationHistory
 #
-POPDIR = ['', '', '', '', '', '', '', '', '', '']
-LASTPOP = -1
-POPPING = False
+# Description: This class keeps a PaneHistory for every pane.
+#              The histories are saved to HISTORYLIST by a timer
+#              thread shortly after they change and loaded on
+#              the watcher thread when fman starts, so recording
+#              a visit never touches the disk.
+#
+
+
+HISTORYDEPTH = 100
+HISTORYFLUSHDELAY = 10
+
+
+class NavigationHistory:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self._panes = {}
+        self._loaded = False
+        self._flusher = DelayedCall(HISTORYFLUSHDELAY, self.save)
+        self._lock = threading.Lock()
+
+    def _depth(self):
+        try:
+            return int(getSetting("historyDepth", HISTORYDEPTH))
+        except (TypeError, ValueError):
+            return HISTORYDEPTH
+
+    def pane(self, paneKey):
+        with self._lock:
+            history = self._panes.get(paneKey)
+            if history is None:
+                history = PaneHistory(self._depth())
+                self._panes[paneKey] = history
+            return history
+
+    def visit(self, paneKey, path):
+        history = self.pane(paneKey)
+        with self._lock:
+            if history.navigating == path:
+                history.navigating = None
+                return
+            history.navigating = None
+            history.visit(path)
+        self._flusher.schedule()
+
+    def move(self, paneKey, steps):
+        self.load()
+        history = self.pane(paneKey)
+        with self._lock:
+            path = history.move(steps)
+            if path is not None:
+                history.navigating = path
+        if path is not None:
+            self._flusher.schedule()
+        return path
+
+    def load(self):
+        if self._loaded:
+            return
+        saved = {}
+        if os.path.isfile(self.fileName):
+            try:
+                with open(self.fileName, "r") as f:
+                    saved = json.load(f)
+            except ValueError:
+                saved = {}
+        depth = self._depth()
+        with self._lock:
+            if self._loaded:
+                return
+            for paneKey, state in saved.items():
+                history = PaneHistory(depth)
+                for path in state.get("entries", []):
+                    history.visit(path)
+                current = self._panes.get(paneKey)
+                if current is None:
+                    history.move(state.get("cursor", len(history) - 1) - history.cursor)
+                else:
+                    for path in current.items():
+                        history.visit(path)
+                    history.navigating = current.navigating
+                self._panes[paneKey] = history
+            self._loaded = True
+
+    def save(self):
+        self.load()
+        with self._lock:
+            state = {}
+            for paneKey, history in self._panes.items():
+                state[paneKey] = {"entries": history.items(), "cursor": history.cursor}
+        atomicWriteLines(self.fileName, [json.dumps(state)])
+
+    def flushPending(self):
+        self._flusher.flushNow()
+
+
+HISTORY = NavigationHistory(HISTORYLIST)
+atexit.register(HISTORY.flushPending)
+
+#
+# Function:    paneKey
+#
+# Description: This function gives the key of a pane's history.
+#              It is the pane's position in the window, so the
+#              history of the left pane is restored to the left
+#              pane after a restart.
+#
+
+
+def paneKey(pane):
+    try:
+        return str(pane.window.get_panes().index(pane))
+    except (AttributeError, ValueError):
+        return "0"
 
 #
 # Function:    PopdirectoryListener
@@ -555,31 +3308,125 @@ class PopdirectoryListener(DirectoryPaneListener):
     #
 
     def on_path_changed(self):
-        #
-        # See if the new directory is a project directory.
-        #
-        global LASTPOP, POPDIR, POPPING
+        path = as_human_readable(self.pane.get_path())
+        FRECENCY.record(path)
+        HISTORY.visit(paneKey(self.pane), path)
+        showPathStatus(path)
+
+#
+# Function:    showPathStatus
+#
+# Description: This function shows in the status bar which
+#              favorites, pairs and workspaces the directory
+#              belongs to, and the shortener it is under. It runs
+#              on every directory change, so it only uses what the
+#              watcher has already loaded: the stores' snapshots,
+#              the reverse path index and the shortener index. The
+#              directory is looked up like favoriteForPath does,
+#              so it is also found through links. It doesn't
+#              start the watcher, so that fman's first directory
+#              change doesn't undo deferring it. It does nothing
+#              until a command has started the watcher and its
+#              first pass is done. The message is only cleared if
+#              it was shown here.
+#
 
-        if not POPPING:
-            LASTPOP = (LASTPOP + 1) % 10
-            POPDIR[LASTPOP] = as_human_readable(self.pane.get_path())
 
-        POPPING = False
+PATHSTATUSSHOWN = False
+
+
+def showPathStatus(path):
+    global PATHSTATUSSHOWN
+    if not WATCHER.ready:
+        return
+    with STATS.timer("path status"):
+        PATHINDEX.update()
+        parts = ["%s: %s" % (kind, name) for kind, name in PATHINDEX.find(path)]
+        index = SHORTENERINDEX
+        if index is not None and '://' not in path:
+            found = index.match(pathComponents(path))
+            if found is not None and found[0] != "~":
+                parts.append("Under " + found[0])
+    if parts:
+        show_status_message(", ".join(parts))
+        PATHSTATUSSHOWN = True
+    elif PATHSTATUSSHOWN:
+        clear_status_message()
+        PATHSTATUSSHOWN = False
 
 #
 # Function:    PopDir
 #
 # Description: This command will go the a previously visited
-#              directory. Executing without the parameter just
-#              goes back to the last directory. A non-zero will
-#              go back that many past the last directory.
+#              directory in this pane. Executing without the
+#              parameter just goes back to the last directory. A
+#              non-zero will go back that many past the last
+#              directory.
 #
 
 
 class PopDir(DirectoryPaneCommand):
 
     def __call__(self, dirNum=0):
-        global LASTPOP, POPDIR, POPPING
-        LASTPOP = abs(LASTPOP - 1 - dirNum)
-        POPPING = True
-        self.pane.set_path(as_url(POPDIR[LASTPOP]))
+        path = HISTORY.move(paneKey(self.pane), -1 - dirNum)
+        if path is not None:
+            navigate(self.pane, as_url(path))
+
+#
+# Function:    GoToRecentDirectory
+#
+# Description: This class shows every directory that has been
+#              visited in a quicksearch, with the most often and
+#              most recently visited ones first, and goes to the
+#              one the user selects.
+#
+
+
+class GoToRecentDirectory(DirectoryPaneCommand):
+
+    def __call__(self):
+        show_status_message('Recent Directory Selection')
+        result = show_quicksearch(self._suggest_directory)
+        if result:
+            query, dirName = result
+            if '://' in dirName:
+                navigate(self.pane, dirName)
+            else:
+                navigate(self.pane, as_url(dirName))
+        clear_status_message()
+
+    def _suggest_directory(self, query):
+        #
+        # The directories visited since the sorted list was made
+        # are matched on their own and merged with the matches
+        # of the sorted list, where they are left out.
+        #
+        paths, changed, keys = FRECENCY.rankedPaths()
+        matches = [match for match in getMatcher(
+            "GoToRecentDirectory", paths, scoreEntry=self._score_directory,
+            ordered=True).ranked(query, MAXSUGGESTIONS + len(keys)) if match[1] not in keys]
+        if changed:
+            matches.extend(getMatcher("GoToRecentDirectory changes", changed,
+                                      scoreEntry=self._score_directory).ranked(query))
+            matches.sort(key=lambda match: match[0])
+        return [QuicksearchItem(name, highlight=highlight)
+                for key, name, highlight in matches[0:MAXSUGGESTIONS]]
+
+    def _score_directory(self, entry):
+        return entry[1]
+
+#
+# Function:    ForwardDir
+#
+# Description: This command goes forward again in this pane's
+#              history after a PopDir. A non-zero parameter
+#              goes forward that many more directories.
+#
+
+
+class ForwardDir(DirectoryPaneCommand):
+
+    def __call__(self, dirNum=0):
+        path = HISTORY.move(paneKey(self.pane), 1 + dirNum)
+        if path is not None:
+            navigate(self.pane, as_url(path))
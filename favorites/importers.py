@@ -0,0 +1,129 @@
+#
+# Load the libraries that are used in this module.
+#
+import os
+import struct
+from urllib.parse import unquote, urlparse
+
+#
+# Function:    readZoxide
+#
+# Description: This function reads the directories of a zoxide
+#              database. The binary db.zo file is a format version
+#              followed by a bincode list of (path, rank, last
+#              access) records, read one record at a time. The
+#              text of "zoxide query --list --score" is read too.
+#
+
+
+def readZoxide(fileName):
+    with open(fileName, "rb") as f:
+        header = f.read(12)
+        if len(header) == 12 and header[1:4] == b"\0\0\0":
+            count = struct.unpack("<Q", header[4:12])[0]
+            for index in range(count):
+                size = f.read(8)
+                if len(size) < 8:
+                    return
+                path = f.read(struct.unpack("<Q", size)[0])
+                f.read(16)
+                yield path.decode("utf-8", "replace")
+            return
+        f.seek(0)
+        for line in f:
+            fields = line.decode("utf-8", "replace").strip().split(None, 1)
+            if fields:
+                yield fields[-1]
+
+#
+# Function:    readAutojump
+#
+# Description: This function reads the autojump.txt file, where
+#              each line is a weight, a tab and the path.
+#
+
+
+def readAutojump(fileName):
+    with open(fileName, "r", errors="replace") as f:
+        for line in f:
+            weight, separator, path = line.rstrip("\n").partition("\t")
+            if separator and path:
+                yield path
+
+#
+# Function:    readZ
+#
+# Description: This function reads the data file of z (~/.z),
+#              where each line is the path, its rank and the time
+#              separated by "|". The path is everything before the
+#              last two fields, so it may contain "|" itself.
+#
+
+
+def readZ(fileName):
+    with open(fileName, "r", errors="replace") as f:
+        for line in f:
+            fields = line.rstrip("\n").rsplit("|", 2)
+            if len(fields) == 3 and fields[0]:
+                yield fields[0]
+
+#
+# Function:    readGtkBookmarks
+#
+# Description: This function reads the GTK bookmarks file. Each
+#              line is a file:// URL and an optional label. Other
+#              URLs are left out.
+#
+
+
+def readGtkBookmarks(fileName):
+    with open(fileName, "r", errors="replace") as f:
+        for line in f:
+            fields = line.strip().split(" ", 1)
+            if fields[0].startswith("file://"):
+                yield unquote(urlparse(fields[0]).path)
+
+#
+# Function:    readPathList
+#
+# Description: This function reads a plain list with one path on
+#              each line. A line of name|path, like the favorites
+#              file, gives just the path.
+#
+
+
+def readPathList(fileName):
+    with open(fileName, "r", errors="replace") as f:
+        for line in f:
+            path = line.strip()
+            if "|" in path:
+                path = path.split("|", 1)[1]
+            if path and not path.startswith("#"):
+                yield path
+
+#
+# Function:    readCdpath
+#
+# Description: This function gives the directories of a CDPATH
+#              value, which are separated by ":".
+#
+
+
+def readCdpath(value):
+    for path in value.split(os.pathsep):
+        if path and path != ".":
+            yield path
+
+#
+# The importers by the name shown to the user: the function that
+# reads the paths and where its data usually is. The CDPATH
+# importer reads the value of the variable instead of a file.
+#
+IMPORTERS = [
+    ("zoxide", readZoxide, "~/.local/share/zoxide/db.zo"),
+    ("autojump", readAutojump, "~/.local/share/autojump/autojump.txt"),
+    ("z", readZ, "~/.z"),
+    ("CDPATH", readCdpath, None),
+    ("GTK bookmarks", readGtkBookmarks, "~/.config/gtk-3.0/bookmarks"),
+    ("Path list", readPathList, "~/paths.txt"),
+]
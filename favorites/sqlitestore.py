@@ -0,0 +1,174 @@
+#
+# Load the libraries that are used in this module.
+#
+import os
+import sqlite3
+import threading
+
+#
+# Function:    SqliteFavoritesStore
+#
+# Description: This class is the indexed storage backend for a
+#              list of favorites. It has the same methods as the
+#              text FavoritesStore. Each list is a table in a
+#              local SQLite file with the name as its primary
+#              key, so looking up one name is a B-tree search
+#              instead of a scan of the whole list. The full list
+#              is only loaded for the quicksearch and is kept
+#              until the database file changes. The meta table
+#              keeps which lists have been imported.
+#
+
+
+class SqliteFavoritesStore:
+
+    def __init__(self, fileName, table, fieldCount):
+        self.fileName = fileName
+        self.table = table
+        self.fieldCount = fieldCount
+        self.version = 0
+        self.watched = False
+        self._signature = None
+        self._entries = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.fileName, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS " + self.table +
+                " (name TEXT PRIMARY KEY, fields TEXT NOT NULL, seq INTEGER NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS " + self.table + "_seq ON " +
+                self.table + " (seq)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection.commit()
+        return self._connection
+
+    def _statSignature(self):
+        try:
+            st = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _toEntry(self, name, fields):
+        entry = (name,) + tuple(fields.split('|'))
+        if len(entry) < self.fieldCount:
+            return None
+        return entry[0:self.fieldCount]
+
+    def _changed(self):
+        self._entries = None
+        self._signature = self._statSignature()
+        self.version += 1
+
+    def refresh(self):
+        with self._lock:
+            connection = self._connect()
+            signature = self._statSignature()
+            if self._entries is None or signature != self._signature:
+                entries = []
+                for name, fields in connection.execute(
+                        "SELECT name, fields FROM " + self.table + " ORDER BY seq"):
+                    entry = self._toEntry(name, fields)
+                    if entry is not None:
+                        entries.append(entry)
+                self._entries = tuple(entries)
+                self._signature = signature
+                self.version += 1
+            return self._entries
+
+    def entries(self):
+        entries = self._entries
+        if self.watched and entries is not None:
+            return entries
+        return self.refresh()
+
+    def lookup(self, name):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT fields FROM " + self.table + " WHERE name = ?",
+                (name,)).fetchone()
+        if row is None:
+            return None
+        return self._toEntry(name, row[0])
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+    def _insert(self, connection, entries):
+        connection.executemany(
+            "INSERT OR REPLACE INTO " + self.table + " (name, fields, seq) VALUES " +
+            "(?, ?, (SELECT IFNULL(MAX(seq), 0) + 1 FROM " + self.table + "))",
+            (((entry[0], "|".join(entry[1:])) for entry in entries)))
+
+    def append(self, entry):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._insert(connection, [tuple(entry)])
+            self._changed()
+
+    def remove(self, name):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    "DELETE FROM " + self.table + " WHERE name = ?", (name,))
+            self._changed()
+            return cursor.rowcount > 0
+
+    def extend(self, entries):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._insert(connection, [tuple(entry) for entry in entries])
+            self._changed()
+
+    def rewrite(self, entries):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM " + self.table)
+                self._insert(connection, entries)
+            self._changed()
+
+    def importOnce(self, readEntries):
+        #
+        # This fills the table with the entries from readEntries
+        # the first time it is opened. A row in the meta table
+        # records that it was, so a list that is emptied later
+        # stays empty. A table that already has entries from
+        # before the meta table counts as imported.
+        #
+        key = "imported " + self.table
+        with self._lock:
+            connection = self._connect()
+            if connection.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return
+            with connection:
+                if connection.execute("SELECT 1 FROM " + self.table + " LIMIT 1").fetchone() is None:
+                    self._insert(connection, [tuple(entry) for entry in readEntries()])
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   (key, "1"))
+            self._changed()
+
+    def rewritePaths(self, rewritePath):
+        def rewriteFields(fields):
+            return "|".join(rewritePath(field) for field in fields.split('|'))
+        with self._lock:
+            connection = self._connect()
+            connection.create_function("rewritefields", 1, rewriteFields)
+            with connection:
+                connection.execute(
+                    "UPDATE " + self.table + " SET fields = rewritefields(fields)")
+            self._changed()
+
+    def compact(self):
+        with self._lock:
+            self._connect().execute("VACUUM")
+            self._changed()